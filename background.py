@@ -0,0 +1,135 @@
+"""Background model for the motion detectors. They used to diff each
+   blurred frame against the previous one only, so slow motion vanished
+   (little changes between consecutive frames) and every frame paid for a
+   21x21 GaussianBlur at full camera resolution. BackgroundModel keeps an
+   exponential running average of the scene (cv2.accumulateWeighted), or
+   optionally a MOG2 mixture model, and compares each new frame against
+   that. Pixels under the (dilated) motion mask are left out of the
+   update, so a moving target doesn't smear a ghost trail into the
+   background behind it. A masked pixel that hasn't changed from frame
+   to frame for 'absorb' frames is taken into the background as it is:
+   something that stops, or the ghost of something in view when the
+   model started (the first frame is the first background), drops out
+   within a fraction of a second, while a moving target keeps changing
+   and stays in the mask. Frames are
+   shrunk with pyrDown first, so blur, diff and dilate all run on a
+   quarter (or less) of the pixels; 'scale' converts mask coordinates
+   back to camera pixels.
+
+       background = BackgroundModel(rate=0.05, levels=2, threshold=10)
+       mask = background.apply(gray) # uint8, 255 where moving
+"""
+
+import cv2
+import numpy as np
+
+
+class BackgroundModel(object):
+    """Motion mask from a learned background. method is "average" (running
+       average, thresholded absolute difference) or "mog2". rate is the
+       background update rate per frame (0-1; lower = slower to absorb
+       a changed scene; too high and slow motion is absorbed before it's
+       seen); pixels seen moving aren't updated. absorb is the number of
+       frames a masked pixel may stay within 'still' gray levels of the
+       last frame before it's made background (average only). levels is
+       the number of pyrDown halvings applied first. blur is the Gaussian
+       kernel size in camera pixels (scaled down to match), threshold the
+       difference in gray levels that counts as motion (average only),
+       dilate the number of dilate iterations on the mask."""
+
+    def __init__(self, method="average", rate=0.05, levels=2, blur=21,
+                 threshold=10, dilate=2, absorb=10, still=2):
+        if method not in ("average", "mog2"):
+            raise ValueError("unknown background method %r" % method)
+        self.method = method
+        self.rate = rate
+        self.absorb = absorb
+        self.still = still
+        self.levels = levels
+        self.scale = 1 << levels # Mask pixel size, in camera pixels
+        self.blur = max(3, (blur // self.scale) | 1) # Odd kernel size
+        self.threshold = threshold
+        self.dilate = dilate
+        self.background = None # float32 running average (average method)
+        self.held = None       # Frames each pixel was masked but still
+        self.previous = None   # Last prepared frame (average method)
+        self.subtractor = None
+        if method == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=max(1, int(round(1.0 / rate))), detectShadows=False)
+
+    def reset(self):
+        """Forget the learned background (e.g. after the camera moves)."""
+        self.background = self.held = self.previous = None
+        if self.subtractor is not None:
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=max(1, int(round(1.0 / self.rate))),
+                detectShadows=False)
+
+    def prepare(self, gray):
+        """Downsampled, blurred copy of a grayscale camera frame."""
+        for _ in range(self.levels):
+            gray = cv2.pyrDown(gray)
+        return cv2.GaussianBlur(gray, (self.blur, self.blur), 0)
+
+    def apply(self, gray):
+        """Motion mask for a grayscale camera frame (uint8, 0 or 255, at
+           1/scale resolution), then fold the frame into the background."""
+        small = self.prepare(gray)
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(small, learningRate=self.rate)
+            if self.dilate:
+                mask = cv2.dilate(mask, None, iterations=self.dilate)
+            return mask
+        if self.background is None:
+            self.background = small.astype(np.float32)
+            self.held = np.zeros(small.shape, np.uint16)
+            self.previous = small
+            return np.zeros_like(small)
+        # Compare against the background before updating it, so whatever
+        # is moving isn't already partly blended in.
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1]
+        if self.dilate:
+            mask = cv2.dilate(mask, None, iterations=self.dilate)
+        # Selective update: only the still pixels, so the moving ones (and
+        # the dilated margin round them) leave no trail behind.
+        cv2.accumulateWeighted(small, self.background, self.rate,
+                               cv2.bitwise_not(mask))
+        # Masked pixels that stay unchanged are a stopped object or a
+        # ghost of the first frame, not motion
+        change = cv2.absdiff(small, self.previous)
+        self.previous = small
+        held = (mask > 0) & (change <= self.still)
+        self.held += 1
+        self.held[~held] = 0
+        stuck = self.held >= self.absorb
+        if stuck.any():
+            self.background[stuck] = small[stuck]
+            self.held[stuck] = 0
+        return mask
+
+    def target(self, mask, largest=False, min_area=1):
+        """Where the motion is, as (x, y, area) in camera pixels, or None
+           if under min_area (in mask pixels) is moving. x, y is the
+           centroid of all moving pixels, from image moments, or with
+           largest=True that of the biggest connected blob. Either way
+           it's one OpenCV call, with no contour lists."""
+        if largest:
+            count, _, stats, centroids = cv2.connectedComponentsWithStats(
+                mask, connectivity=8)
+            if count < 2:
+                return None
+            i = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA]) # 0 = background
+            area = stats[i, cv2.CC_STAT_AREA]
+            x, y = centroids[i]
+        else:
+            m = cv2.moments(mask, binaryImage=True)
+            area = m["m00"]
+            if area < 1:
+                return None
+            x, y = m["m10"] / area, m["m01"] / area
+        if area < min_area:
+            return None
+        return (float(x + 0.5) * self.scale, float(y + 0.5) * self.scale,
+                float(area) * self.scale * self.scale)
@@ -0,0 +1,302 @@
+"""Camera capture in its own thread. cv2.VideoCapture.read() blocks until
+   the camera delivers a frame, so calling it from frame() held rendering
+   to the camera's rate (often 15 fps) and stalled the eyes on any USB
+   hiccup. CameraCapture reads continuously in the background and keeps
+   only the newest frame; the render loop asks for it without blocking
+   and skips detection when nothing new has arrived. Frames replaced
+   before anyone took them are counted in 'dropped'.
+
+   Frames can come from a live camera, a video file, a directory of
+   images or a synthetic generator with known target positions, so
+   detectors can be benchmarked and compared on a headless box against
+   the same footage (see detectbench.py). Entry points pick one with
+   --source:
+
+       python3 motion3.py --source 0                # Camera 0 (default)
+       python3 faces.py --source footage.mp4 --loop # Video file, repeated
+       python3 faces.py --source frames/            # Directory of images
+       python3 motion3.py --headless --source synthetic:blob --pace fast
+
+       camera = CameraCapture(open_source("0"), daemon=True)
+       camera.start()
+       ...
+       latest = camera.latest(lastSeq) # None if no newer frame yet
+
+   Recorded and synthetic sources are paced to their frame rate by
+   default ("realtime"); with "fast" each frame is handed over as soon
+   as the previous one has been taken, so nothing is dropped and the
+   consumer sets the pace.
+"""
+
+import atexit
+import math
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+PACES = ("realtime", "fast")
+
+
+class CameraSource(object):
+    """Live camera, by cv2.VideoCapture index. The camera sets its own
+       pace, and a failed read (unplugged, USB hiccup) is retried."""
+
+    live = True
+
+    def __init__(self, index=0, width=0, height=0):
+        self.capture = cv2.VideoCapture(index)
+        if width and height:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.fps = 0.0
+        self.truth = None
+
+    def read(self):
+        return self.capture.read()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(object):
+    """Recorded video, played at its own frame rate; from the start again
+       at the end if loop is set."""
+
+    live = False
+
+    def __init__(self, filename, loop=False):
+        self.capture = cv2.VideoCapture(filename)
+        if not self.capture.isOpened():
+            raise ValueError("can't open video %r" % filename)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.loop = loop
+        self.truth = None
+
+    def read(self):
+        ok, image = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, image = self.capture.read()
+        return ok, image
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirSource(object):
+    """Image files in a directory, in name order, at 'fps'."""
+
+    live = False
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, directory, fps=15.0, loop=False):
+        self.files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if os.path.splitext(name)[1].lower() in self.EXTENSIONS)
+        if not self.files:
+            raise ValueError("no images in %r" % directory)
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        self.truth = None
+
+    def read(self):
+        if self.index >= len(self.files):
+            if not self.loop:
+                return False, None
+            self.index = 0
+        image = cv2.imread(self.files[self.index])
+        self.index += 1
+        return image is not None, image
+
+    def release(self):
+        pass
+
+
+class SyntheticSource(object):
+    """Generated frames with known ground truth: 'count' targets moving on
+       Lissajous paths over a fixed noise background. kind is "blob"
+       (bright discs, for the motion detectors) or "face" (cartoon
+       faces). After each read(), truth is a (count,2) array of target
+       centres in pixels. frames limits the length (0 = endless)."""
+
+    live = False
+
+    def __init__(self, kind="blob", width=640, height=480, count=1,
+                 size=80, fps=30.0, frames=0, seed=0):
+        if kind not in ("blob", "face"):
+            raise ValueError("unknown synthetic source %r" % kind)
+        rng = np.random.default_rng(seed)
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self.size = size
+        self.fps = fps
+        self.frames = frames
+        self.frame = 0
+        noise = rng.normal(90.0, 12.0, (height, width)).astype(np.float32)
+        noise = cv2.GaussianBlur(noise, (5, 5), 0)
+        self.background = cv2.cvtColor(
+            np.clip(noise, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+        self.freq = rng.uniform(0.05, 0.3, (count, 2)) # Cycles per second
+        self.phase = rng.uniform(0.0, 2.0 * math.pi, (count, 2))
+        self.truth = np.zeros((count, 2))
+
+    def read(self):
+        if self.frames and self.frame >= self.frames:
+            return False, None
+        t = self.frame / self.fps
+        self.frame += 1
+        margin = self.size
+        span = np.array((self.width, self.height)) - 2 * margin
+        wave = np.sin(2.0 * math.pi * self.freq * t + self.phase)
+        self.truth = margin + span * (0.5 + 0.5 * wave)
+        image = self.background.copy()
+        r = self.size // 2
+        for x, y in np.rint(self.truth).astype(int).tolist():
+            if self.kind == "blob":
+                cv2.circle(image, (x, y), r, (230, 230, 230), -1)
+            else:
+                cv2.ellipse(image, (x, y), (r * 4 // 5, r), 0, 0, 360,
+                            (150, 180, 220), -1)
+                for dx in (-r // 3, r // 3):
+                    cv2.circle(image, (x + dx, y - r // 4), r // 8,
+                               (40, 30, 30), -1)
+                cv2.ellipse(image, (x, y + r // 3), (r // 3, r // 8), 0, 0,
+                            180, (60, 40, 120), -1)
+        return True, image
+
+    def release(self):
+        pass
+
+
+def open_source(spec, loop=False, width=0, height=0):
+    """Frame source from a --source string: a camera index ("0"),
+       "synthetic" or "synthetic:KIND", a directory of images, or a
+       video file."""
+    spec = str(spec)
+    if spec.isdigit():
+        return CameraSource(int(spec), width, height)
+    if spec.split(":")[0] == "synthetic":
+        return SyntheticSource(spec.partition(":")[2] or "blob")
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, loop=loop)
+    return VideoFileSource(spec, loop=loop)
+
+
+def add_source_arguments(parser):
+    """Add the frame source options to an entry point's ArgumentParser."""
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file, image directory "
+                             "or synthetic[:blob|face]")
+    parser.add_argument("--pace", choices=PACES, default="realtime",
+                        help="recorded sources: play at their frame rate, "
+                             "or as fast as frames are taken")
+    parser.add_argument("--loop", action="store_true",
+                        help="restart a video file or image directory at "
+                             "the end")
+
+
+def source_from_args(args):
+    """Frame source for the options added by add_source_arguments()."""
+    return open_source(args.source, args.loop)
+
+
+class CameraCapture(threading.Thread):
+    """Background reader for a frame source (see above; a camera index or
+       file name is opened with open_source()). pace is "realtime" or
+       "fast", see module notes; live cameras always run at their own
+       rate. max_fps, if set, caps the rate frames are read at for any
+       source (see governor.py). A recorded source that runs out sets
+       'ended' and stops the thread. Extra keyword arguments go to
+       threading.Thread (e.g. daemon=True)."""
+
+    def __init__(self, source=0, pace="realtime", **kwargs):
+        super(CameraCapture, self).__init__(**kwargs)
+        if not hasattr(source, "read"):
+            source = open_source(source)
+        if pace not in PACES:
+            raise ValueError("unknown pace %r" % pace)
+        self.source = source
+        self.pace = pace
+        self.max_fps = 0.0   # Read rate cap, 0 = none
+        self.running = True
+        self.ended = False   # Recorded source ran out
+        self.seq = 0         # Frames captured so far
+        self.timestamp = 0.0 # time.time() when latest frame was read
+        self.truth = None    # Ground truth for the frame latest() returned
+        self.dropped = 0     # Frames replaced before being taken
+        self.failures = 0    # Failed reads (no camera...)
+        self._frame = None
+        self._truth = None
+        self._taken = 0      # seq of last frame handed out
+        self._lock = threading.Condition()
+        # Stop the thread before interpreter teardown; OpenCV aborts if a
+        # thread that used it is still live while its globals are freed.
+        atexit.register(self.stop)
+
+    def run(self):
+        source = self.source
+        interval = 0.0
+        if self.pace == "realtime" and not source.live and source.fps:
+            interval = 1.0 / source.fps
+        next_time = last_read = time.time()
+        while self.running:
+            if self.max_fps: # Capped; leave frames in the camera's queue
+                delay = last_read + 1.0 / self.max_fps - time.time()
+                if delay > 0:
+                    time.sleep(min(delay, 0.1)) # Recheck cap if lifted
+                    continue
+            last_read = time.time()
+            if self.pace == "fast" and not source.live:
+                with self._lock: # Wait for the last frame to be taken
+                    while self.running and self.seq > self._taken:
+                        self._lock.wait(0.1)
+            ok, frame = source.read()
+            if not ok:
+                if not source.live:
+                    self.ended = True
+                    break
+                self.failures += 1
+                time.sleep(0.05) # Don't spin while the camera's missing
+                continue
+            if interval:
+                next_time += interval
+                delay = next_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else: # Fell behind; don't try to catch up
+                    next_time = time.time()
+            now = time.time()
+            # read() returns a new array each call, so the reference can
+            # be handed over as-is; nothing is copied.
+            truth = None if source.truth is None else source.truth.copy()
+            with self._lock:
+                if self.seq > self._taken:
+                    self.dropped += 1
+                self._frame = frame
+                self._truth = truth
+                self.seq += 1
+                self.timestamp = now
+        source.release()
+
+    def latest(self, after=0):
+        """Newest frame as (seq, timestamp, image) if its seq is greater
+           than 'after' (the seq last processed), else None. Never
+           blocks on the camera. For synthetic sources, 'truth' is then
+           the target positions in that frame."""
+        with self._lock:
+            if self.seq <= after:
+                return None
+            self._taken = self.seq
+            self.truth = self._truth
+            self._lock.notify()
+            return self.seq, self.timestamp, self._frame
+
+    def stop(self, timeout=1.0):
+        """Stop reading and release the source."""
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
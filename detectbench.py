@@ -0,0 +1,116 @@
+"""Detector benchmark. Runs one of the eye scripts' detection pipelines
+   over a frame source (see capture.py) as fast as it will go, without
+   rendering, and reports throughput, per-frame cost and, for synthetic
+   sources, how far the detected target is from the true one. Run the
+   same footage before and after a detector change to compare:
+
+       python3 detectbench.py --source synthetic:blob --detector motion
+       python3 detectbench.py --source footage.mp4 --detector faces-track
+
+   Synthetic targets are in view from the first frame, as when a prop is
+   powered up with someone in front of it, so the motion detectors'
+   start-up (clearing the target's ghost from the first background) is
+   part of the result; only the first --warmup frames are left out.
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+from background import BackgroundModel
+from capture import open_source
+
+DETECTORS = ("motion", "motion-largest", "faces", "faces-track")
+
+
+def make_detector(name, cascade_file):
+    """Function of a BGR camera frame returning the target (x, y) in
+       camera pixels, or None; configured as in the eye scripts."""
+    if name.startswith("motion"):
+        background = BackgroundModel("average", rate=0.05, levels=2,
+                                     threshold=10)
+        largest = name == "motion-largest"
+
+        def detect(image):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            target = background.target(background.apply(gray), largest)
+            return None if target is None else target[0:2]
+        return detect
+
+    from detector import FaceSearch, FaceTracker
+    finder = FaceSearch(cv2.CascadeClassifier(cascade_file), 1.1, 4,
+                        scale=0.5, min_size=60, roi_pad=0.5,
+                        full_scan_interval=10)
+    if name == "faces-track":
+        finder = FaceTracker(finder, 5)
+
+    def detect(image):
+        faces = finder.detect(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        if not len(faces):
+            return None
+        x, y, w, h = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        return x + w * 0.5, y + h * 0.5
+    return detect
+
+
+def run(source, detect, max_frames):
+    """Feed up to max_frames frames (0 = all) from source through detect.
+       Returns per-frame detection times (s), and target errors in
+       pixels against the source's ground truth (NaN = missed), if it
+       has any."""
+    times = []
+    errors = []
+    while not max_frames or len(times) < max_frames:
+        ok, image = source.read()
+        if not ok:
+            break
+        start = time.perf_counter()
+        target = detect(image)
+        times.append(time.perf_counter() - start)
+        if source.truth is not None:
+            if target is None:
+                errors.append(np.nan)
+            else:
+                offsets = np.asarray(source.truth) - target
+                errors.append(np.sqrt((offsets ** 2).sum(axis=1)).min())
+    source.release()
+    return np.array(times), np.array(errors)
+
+
+def report(times, errors, warmup=0):
+    """Text summary of run() results, skipping the first warmup frames
+       (background model settling, first full scan)."""
+    times, errors = times[warmup:], errors[warmup:]
+    if not len(times):
+        return "no frames"
+    ms = times * 1000.0
+    lines = ["%d frames, %.1f fps" % (len(times), len(times) / times.sum()),
+             "  detect ms  p50 %.3f  p95 %.3f  max %.3f" % (
+                 np.percentile(ms, 50), np.percentile(ms, 95), ms.max())]
+    if len(errors):
+        hits = errors[~np.isnan(errors)]
+        lines.append("  found %.1f%%" % (100.0 * len(hits) / len(errors)))
+        if len(hits):
+            lines.append("  error px  mean %.1f  p50 %.1f  p95 %.1f" % (
+                hits.mean(), np.percentile(hits, 50),
+                np.percentile(hits, 95)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark eye detectors")
+    parser.add_argument("--source", default="synthetic",
+                        help="as for the eye scripts, see capture.py")
+    parser.add_argument("--detector", choices=DETECTORS, default="motion")
+    parser.add_argument("--frames", type=int, default=300,
+                        help="frames to run (0 = whole source)")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="frames left out of the summary (raise to "
+                             "exclude detector start-up)")
+    parser.add_argument("--cascade",
+                        default="haarcascade_frontalface_default.xml")
+    args = parser.parse_args()
+    times, errors = run(open_source(args.source),
+                        make_detector(args.detector, args.cascade),
+                        args.frames)
+    print(report(times, errors, args.warmup))
@@ -0,0 +1,313 @@
+"""Face detection in a separate process. detectMultiScale() takes tens of
+   milliseconds per frame on a Pi and holds the GIL throughout, so on the
+   render thread it cost frames even with capture threaded. FaceDetector
+   runs the Haar cascade in a worker process on another core. Frames and
+   results are exchanged through multiprocessing shared memory rather
+   than pickled over a pipe:
+
+     frame block:  float64 seq, float64 timestamp, then the uint8
+                   grayscale image
+     result block: float64 seq, capture timestamp, time detected,
+                   face count, then up to max_faces (x, y, w, h) boxes
+
+   submit() overwrites the frame block with the newest frame, so the
+   worker always detects on the latest one and never builds a backlog.
+   latest() returns the most recent published result, if newer than the
+   one last seen, along with the timestamp of the frame it came from so
+   callers can ignore stale detections.
+
+   The worker doesn't run the cascade over the full frame each time, see
+   FaceSearch: it detects on a downscaled copy, and once a face is found
+   searches only a padded region around it, with a full scan every few
+   frames or as soon as the face is lost. With detect_interval set, the
+   cascade runs only every so many frames and FaceTracker follows the
+   face in between with Lucas-Kanade optical flow, which is far cheaper.
+"""
+
+import atexit
+import multiprocessing
+import time
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+HEADER = 2 # float64s ahead of the image in the frame block
+RESULT_HEADER = 4 # float64s ahead of the boxes in the result block
+
+
+class FaceSearch(object):
+    """Reduced-resolution, region-restricted Haar search. Frames are
+       shrunk by 'scale' before detection; min_size and max_size are face
+       sizes in full-frame pixels (0 = no upper limit) and are scaled to
+       match, so the cascade never tries window sizes that can't be a
+       face at this camera distance. After a hit, the next frames search
+       only the last face's box grown by roi_pad face widths on each
+       side; every full_scan_interval frames, or when the region comes
+       up empty, the whole (downscaled) frame is scanned again. Boxes are
+       returned in full-frame coordinates."""
+
+    def __init__(self, cascade, scale_factor=1.1, min_neighbors=4,
+                 scale=0.5, min_size=60, max_size=0, roi_pad=0.5,
+                 full_scan_interval=10):
+        self.cascade = cascade
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.scale = scale
+        self.min_size = max(1, int(round(min_size * scale)))
+        self.max_size = int(round(max_size * scale))
+        self.roi_pad = roi_pad
+        self.full_scan_interval = full_scan_interval
+        self.last = None # Last face (x, y, w, h), downscaled coords
+        self.frames_since_scan = 0
+        self.full_scans = 0 # Totals, for tuning
+        self.roi_scans = 0
+
+    def _detect(self, image, x0=0, y0=0):
+        max_size = self.max_size or min(image.shape)
+        faces = self.cascade.detectMultiScale(
+            image, self.scale_factor, self.min_neighbors,
+            minSize=(self.min_size, self.min_size),
+            maxSize=(max_size, max_size))
+        faces = np.asarray(faces, dtype=np.float64).reshape(-1, 4)
+        faces[:, 0] += x0
+        faces[:, 1] += y0
+        return faces
+
+    def detect(self, gray):
+        """Faces in a grayscale frame, as an (N,4) float array of x, y, w,
+           h boxes in the frame's own pixel coordinates."""
+        if self.scale != 1.0:
+            small = cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = gray
+        faces = None
+        if (self.last is not None and
+                self.frames_since_scan < self.full_scan_interval):
+            x, y, w, h = self.last
+            pad = self.roi_pad * max(w, h)
+            x0, y0 = int(max(x - pad, 0)), int(max(y - pad, 0))
+            x1 = int(min(x + w + pad, small.shape[1]))
+            y1 = int(min(y + h + pad, small.shape[0]))
+            if x1 - x0 >= self.min_size and y1 - y0 >= self.min_size:
+                self.roi_scans += 1
+                self.frames_since_scan += 1
+                faces = self._detect(small[y0:y1, x0:x1], x0, y0)
+                if not len(faces):
+                    faces = None # Lost it; fall back to a full scan
+        if faces is None:
+            self.full_scans += 1
+            self.frames_since_scan = 0
+            faces = self._detect(small)
+        if len(faces):
+            # Follow the largest (nearest) face
+            self.last = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        else:
+            self.last = None
+        return faces / self.scale
+
+
+class FaceTracker(object):
+    """Detect-then-track: runs 'search' (a FaceSearch) every
+       detect_interval frames and, in between, moves the last face box by
+       the median motion of a few corner features inside it, tracked with
+       pyramidal Lucas-Kanade optical flow. If fewer than min_points
+       features survive, the face is taken as lost and the cascade runs
+       on that frame. Same detect() interface as FaceSearch; between
+       cascade runs only the tracked face is returned."""
+
+    def __init__(self, search, detect_interval=5, max_points=20,
+                 min_points=6):
+        self.search = search
+        self.detect_interval = detect_interval
+        self.max_points = max_points
+        self.min_points = min_points
+        self.prev = None   # Previous frame (own copy)
+        self.points = None # Tracked features, (N,1,2) float32
+        self.box = None    # Tracked face (x, y, w, h)
+        self.frames_since_detect = 0
+        self.detections = 0 # Totals, for tuning
+        self.tracked = 0
+
+    def _features(self, gray, box):
+        """Corner features in the middle of a face box (the edges are
+           mostly background, which wouldn't move with the face)."""
+        x, y, w, h = box
+        x0, y0 = int(max(x + w * 0.2, 0)), int(max(y + h * 0.2, 0))
+        x1 = int(min(x + w * 0.8, gray.shape[1]))
+        y1 = int(min(y + h * 0.8, gray.shape[0]))
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        points = cv2.goodFeaturesToTrack(gray[y0:y1, x0:x1], self.max_points,
+                                         0.01, max(2, (x1 - x0) // 10))
+        if points is None or len(points) < self.min_points:
+            return None
+        return points + np.float32((x0, y0))
+
+    def detect(self, gray):
+        """Faces in a grayscale frame, as from FaceSearch.detect()."""
+        if (self.points is not None and
+                self.frames_since_detect < self.detect_interval):
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(
+                self.prev, gray, self.points, None,
+                winSize=(15, 15), maxLevel=2)
+            good = status.ravel() == 1
+            if np.count_nonzero(good) >= self.min_points:
+                shift = np.median(moved[good] - self.points[good], axis=0)
+                self.box = self.box + (shift[0, 0], shift[0, 1], 0.0, 0.0)
+                self.points = moved[good].reshape(-1, 1, 2)
+                self.prev[:] = gray
+                self.frames_since_detect += 1
+                self.tracked += 1
+                return self.box.reshape(1, 4)
+
+        faces = self.search.detect(gray)
+        self.detections += 1
+        self.frames_since_detect = 0
+        if len(faces):
+            self.box = faces[np.argmax(faces[:, 2] * faces[:, 3])].copy()
+            self.points = self._features(gray, self.box)
+            if self.prev is None or self.prev.shape != gray.shape:
+                self.prev = gray.copy()
+            else:
+                self.prev[:] = gray
+        else:
+            self.box = self.points = None
+        return faces
+
+
+def _worker(cascade_file, scale_factor, min_neighbors, max_faces,
+            detect_interval, search, shape, frame_name, result_name,
+            frame_lock, result_lock, ready, stop):
+    """Detector process main loop. search is a dict of FaceSearch
+       options."""
+    frame_shm = shared_memory.SharedMemory(name=frame_name)
+    result_shm = shared_memory.SharedMemory(name=result_name)
+    header = np.ndarray((HEADER,), dtype=np.float64, buffer=frame_shm.buf)
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=frame_shm.buf,
+                       offset=HEADER * 8)
+    result = np.ndarray((RESULT_HEADER + max_faces * 4,), dtype=np.float64,
+                        buffer=result_shm.buf)
+    gray = np.empty(shape, dtype=np.uint8)
+    finder = FaceSearch(cv2.CascadeClassifier(cascade_file), scale_factor,
+                        min_neighbors, **search)
+    if detect_interval > 1:
+        finder = FaceTracker(finder, detect_interval)
+    try:
+        while not stop.is_set():
+            if not ready.wait(0.1):
+                continue
+            with frame_lock:
+                ready.clear()
+                np.copyto(gray, frame)
+                seq, timestamp = header
+            faces = finder.detect(gray)[:max_faces]
+            with result_lock:
+                result[RESULT_HEADER:RESULT_HEADER + faces.size] = (
+                    faces.ravel())
+                result[0:RESULT_HEADER] = (seq, timestamp, time.time(),
+                                           len(faces))
+    finally:
+        del header, frame, result
+        frame_shm.close()
+        result_shm.close()
+
+
+class FaceDetector(object):
+    """Haar cascade face detector in a worker process; see module notes.
+       If detect_interval is over 1, the cascade runs only that often and
+       faces are tracked in between (FaceTracker). Further keyword
+       arguments (scale, min_size, max_size, roi_pad, full_scan_interval)
+       are passed on to FaceSearch. The
+       worker and shared memory are set up on the first submit(), once
+       the frame size is known."""
+
+    def __init__(self, cascade_file, scale_factor=1.1, min_neighbors=4,
+                 max_faces=8, detect_interval=0, **search):
+        self.cascade_file = cascade_file
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.max_faces = max_faces
+        self.detect_interval = detect_interval
+        self.search = search
+        self.shape = None
+        self.process = None
+        self._seq = 0
+        self._frame_shm = self._result_shm = None
+
+    def _start(self, shape):
+        self.shape = shape
+        size = int(np.prod(shape))
+        self._frame_shm = shared_memory.SharedMemory(
+            create=True, size=HEADER * 8 + size)
+        self._result_shm = shared_memory.SharedMemory(
+            create=True, size=(RESULT_HEADER + self.max_faces * 4) * 8)
+        self._header = np.ndarray((HEADER,), dtype=np.float64,
+                                  buffer=self._frame_shm.buf)
+        self._frame = np.ndarray(shape, dtype=np.uint8,
+                                 buffer=self._frame_shm.buf,
+                                 offset=HEADER * 8)
+        self._result = np.ndarray((RESULT_HEADER + self.max_faces * 4,),
+                                  dtype=np.float64,
+                                  buffer=self._result_shm.buf)
+        self._result[:] = 0.0
+        self._frame_lock = multiprocessing.Lock()
+        self._result_lock = multiprocessing.Lock()
+        self._ready = multiprocessing.Event()
+        self._stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_worker, daemon=True,
+            args=(self.cascade_file, self.scale_factor, self.min_neighbors,
+                  self.max_faces, self.detect_interval, self.search,
+                  shape, self._frame_shm.name, self._result_shm.name,
+                  self._frame_lock, self._result_lock, self._ready,
+                  self._stop))
+        self.process.start()
+        atexit.register(self.close)
+
+    def submit(self, gray, timestamp):
+        """Hand a grayscale frame (2D uint8 array) to the detector,
+           replacing any frame it hasn't started on yet. timestamp is
+           when the frame was captured; it comes back with the result."""
+        if self.process is None:
+            self._start(gray.shape)
+        elif gray.shape != self.shape:
+            raise ValueError("frame size changed from %s to %s" %
+                             (self.shape, gray.shape))
+        self._seq += 1
+        with self._frame_lock:
+            np.copyto(self._frame, gray)
+            self._header[:] = (self._seq, timestamp)
+            self._ready.set()
+
+    def latest(self, after=0):
+        """Most recent result as (seq, timestamp, faces) if its seq is
+           greater than 'after' (the seq last used), else None. faces is
+           an (N,4) int array of x, y, w, h boxes; timestamp is when the
+           detected frame was captured."""
+        if self.process is None:
+            return None
+        with self._result_lock:
+            seq = int(self._result[0])
+            if seq <= after:
+                return None
+            timestamp = self._result[1]
+            count = int(self._result[3])
+            faces = self._result[RESULT_HEADER:RESULT_HEADER + count * 4]
+            faces = faces.astype(np.intp).reshape(-1, 4)
+        return seq, timestamp, faces
+
+    def close(self):
+        """Stop the worker and release shared memory."""
+        if self.process is None:
+            return
+        self._stop.set()
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        del self._header, self._frame, self._result
+        for shm in (self._frame_shm, self._result_shm):
+            shm.close()
+            shm.unlink()
+        self._frame_shm = self._result_shm = None
@@ -0,0 +1,510 @@
+"""Eye animation and rendering engine shared by all the entry points
+   (eyes.py, cyclops.py, faces.py, motion2.py, motion3.py). Each of those
+   used to carry its own copy of frame() with a few dozen globals; the
+   per-eye state now lives in slotted objects here, and each entry point
+   just gathers its inputs (pupil scale, gaze target, buttons) into an
+   EyeInputs and calls EyeRig.update() and EyeRig.render() once a frame.
+   Nothing here reads GPIO or the camera, so the animation logic can be
+   driven and measured on its own."""
+
+import math
+import random
+import pi3d
+from gfxutil import (mesh_init, mesh_regen, mesh_set, mesh_vertices,
+                     points_bounds_array, points_interp_array, zangle)
+from frametimer import NULL_TIMER
+from meshcache import IrisMeshes, LidMeshes, MeshCache
+from meshdetail import DEFAULT_DETAIL
+from svgcache import default_cache_dir, eye_paths, load_eye_points, load_sclera
+
+NOBLINK = 0 # Blink states
+ENBLINK = 1 # Eyelid closing
+DEBLINK = 2 # Eyelid opening
+
+# Frame timer stages and counters marked by EyeRig (see frametimer.py);
+# entry points add their own stages (display wait, camera, etc.) to these.
+RIG_STAGES = ("update", "iris", "upper_lid", "lower_lid", "draw")
+RIG_COUNTERS = ("iris_regen", "lid_regen")
+
+# Per-eye fields of EyeRig.state(), after the shared pupil scale
+EYE_STATE = ("x", "y", "upper", "lower", "blink")
+
+
+class EyeInputs(object):
+    """Per-frame inputs to EyeRig.update(). pupil is the pupil scale
+       (0.0 to 1.0). gaze is an (x, y) eye rotation in degrees to look
+       at, or None to leave eye motion to the rig (autonomous saccades,
+       if enabled, else hold the last position). blink is the state of
+       the blink button (both eyes), wink a sequence of per-eye wink
+       button states in the order eyes were added to the rig."""
+
+    __slots__ = ("pupil", "gaze", "blink", "wink")
+
+    def __init__(self, pupil=0.5, gaze=None, blink=False, wink=()):
+        self.pupil = pupil
+        self.gaze = gaze
+        self.blink = blink
+        self.wink = wink
+
+
+class Gaze(object):
+    """Eye position (x, y rotation in degrees), with the autonomous
+       saccade motion: hold for a random time, then ease to a random
+       point within a 30 degree radius. Shared by both eyes unless
+       they're to move independently (crazy eyes)."""
+
+    __slots__ = ("x", "y", "start_x", "start_y", "dest_x", "dest_y",
+                 "move_duration", "hold_duration", "start_time", "is_moving",
+                 "move_range", "hold_range")
+
+    def __init__(self, move_range=(0.075, 0.175), hold_range=(0.1, 1.1)):
+        self.move_range = move_range
+        self.hold_range = hold_range
+        self.start_x = random.uniform(-30.0, 30.0)
+        n = math.sqrt(900.0 - self.start_x * self.start_x)
+        self.start_y = random.uniform(-n, n)
+        self.dest_x = self.x = self.start_x
+        self.dest_y = self.y = self.start_y
+        self.move_duration = random.uniform(*self.move_range)
+        self.hold_duration = random.uniform(*self.hold_range)
+        self.start_time = 0.0
+        self.is_moving = False
+
+    def set(self, x, y):
+        """Look at a given position (e.g. from a joystick or detector)."""
+        self.x = x
+        self.y = y
+
+    def update(self, now):
+        """Advance autonomous eye motion to time 'now'."""
+        dt = now - self.start_time
+        if self.is_moving:
+            if dt <= self.move_duration:
+                scale = dt / self.move_duration
+                # Ease in/out curve: 3*t^2-2*t^3
+                scale = 3.0 * scale * scale - 2.0 * scale * scale * scale
+                self.x = self.start_x + (self.dest_x - self.start_x) * scale
+                self.y = self.start_y + (self.dest_y - self.start_y) * scale
+            else:
+                self.start_x = self.x = self.dest_x
+                self.start_y = self.y = self.dest_y
+                self.hold_duration = random.uniform(*self.hold_range)
+                self.start_time = now
+                self.is_moving = False
+        elif dt >= self.hold_duration:
+            self.dest_x = random.uniform(-30.0, 30.0)
+            n = math.sqrt(900.0 - self.dest_x * self.dest_x)
+            self.dest_y = random.uniform(-n, n)
+            self.move_duration = random.uniform(*self.move_range)
+            self.start_time = now
+            self.is_moving = True
+
+
+class Lid(object):
+    """One eyelid mesh and the state used to decide when to regenerate
+       it. The mesh spans from the lid edge to the lid's current position,
+       swept back to its previous position, so a fast blink still covers
+       the eye between frames."""
+
+    __slots__ = ("shape", "open_pts", "closed_pts", "edge_pts", "threshold",
+                 "meshes", "steps", "weight", "pts", "regen")
+
+    def __init__(self, shape, open_pts, closed_pts, edge_pts, threshold,
+                 meshes=None, steps=5):
+        self.shape = shape
+        self.open_pts = open_pts
+        self.closed_pts = closed_pts
+        self.edge_pts = edge_pts
+        self.threshold = threshold
+        self.meshes = meshes
+        self.steps = steps # Mesh rows
+        self.weight = 0.5
+        self.pts = points_interp_array(open_pts, closed_pts, 0.5)
+        self.regen = True
+
+    def set_weight(self, weight, flip):
+        """Move lid to weight (0.0 = open, 1.0 = closed), regenerating
+           geometry only if it moved by the regen threshold (or moved
+           last frame, so the swept mesh collapses once it stops, where
+           it last moved to). Returns True if geometry was regenerated."""
+        moved = abs(weight - self.weight) >= self.threshold
+        if moved or self.regen:
+            if not moved:
+                weight = self.weight
+            if self.meshes is not None:
+                mesh_set(self.shape, self.meshes.mesh(self.weight, weight,
+                                                      flip))
+            else:
+                pts = points_interp_array(self.open_pts, self.closed_pts,
+                                          weight)
+                if weight > self.weight:
+                    mesh_regen(self.shape, (self.edge_pts, self.pts, pts),
+                               self.steps, 0, flip)
+                else:
+                    mesh_regen(self.shape, (self.edge_pts, pts, self.pts),
+                               self.steps, 0, flip)
+                self.pts = pts
+            self.weight = weight
+            self.regen = moved
+            return True
+        return False
+
+
+class Eye(object):
+    """Shapes and animation state for one eye: iris, sclera, upper and
+       lower lid, blink state and lid tracking position."""
+
+    __slots__ = ("iris", "sclera", "upper", "lower", "gaze", "convergence",
+                 "flip", "blink_state", "blink_duration", "blink_start_time",
+                 "tracking_pos")
+
+    def __init__(self, iris, sclera, upper, lower, gaze, convergence, flip):
+        self.iris = iris
+        self.sclera = sclera
+        self.upper = upper
+        self.lower = lower
+        self.gaze = gaze
+        self.convergence = convergence
+        self.flip = flip
+        self.blink_state = NOBLINK
+        self.blink_duration = 0.1
+        self.blink_start_time = 0.0
+        self.tracking_pos = 0.3
+
+    def start_blink(self, now, duration):
+        """Begin closing the eyelids."""
+        self.blink_state = ENBLINK
+        self.blink_start_time = now
+        self.blink_duration = duration
+
+    def update_blink(self, now, held, wink):
+        """Advance blink state. 'held' keeps a closing eye closed (blink or
+           wink button down); 'wink' starts a blink if not already in one."""
+        if self.blink_state: # Eye currently winking/blinking?
+            # Check if blink time has elapsed...
+            if (now - self.blink_start_time) >= self.blink_duration:
+                # Yes...increment blink state, unless eye is held closed
+                if not (self.blink_state == ENBLINK and held):
+                    self.blink_state += 1
+                    if self.blink_state > DEBLINK:
+                        self.blink_state = NOBLINK
+                    else:
+                        self.blink_duration *= 2.0
+                        self.blink_start_time = now
+        elif wink:
+            self.start_blink(now, random.uniform(0.035, 0.06))
+
+    def blink_weight(self, now):
+        """How far closed the current blink has the lids (0.0 to 1.0)."""
+        if not self.blink_state:
+            return 0.0
+        n = (now - self.blink_start_time) / self.blink_duration
+        if n > 1.0:
+            n = 1.0
+        if self.blink_state == DEBLINK:
+            n = 1.0 - n
+        return n
+
+
+class EyeRig(object):
+    """All geometry, shapes and state for a set of eyes drawn from one
+       eye SVG. Create the rig once pi3d's display exists, add_eye() for
+       each eye onscreen, then call update() and render() every frame.
+
+       regen_fraction is the change, in pixels, below which iris and lid
+       geometry isn't regenerated (1/4 pixel with 4x4 area sampling, 1/2
+       with 2x2). blink_range is the random duration range of autonomous
+       blinks. tracking_range is the (offset, divisor) mapping gaze Y to
+       lid tracking position. mesh_cache_kb > 0 enables the iris/lid mesh
+       lookup tables (see meshcache.py) with that memory budget. draw, if
+       given, is called with each shape in place of shape.draw() (e.g.
+       HeadlessDisplay.draw, see headless.py). timer, if given, is a
+       FrameTimer to mark with RIG_STAGES and RIG_COUNTERS. detail is the
+       MeshDetail setting mesh resolution (see meshdetail.py)."""
+
+    __slots__ = ("radius", "shader", "iris_map", "sclera_map", "lid_map",
+                 "autoblink", "tracking", "blink_range", "tracking_range",
+                 "autonomous", "eyes", "gazes", "pupil_min", "pupil_max",
+                 "iris_pts", "iris_z", "upper_open", "upper_closed",
+                 "upper_edge", "lower_open", "lower_closed", "lower_edge",
+                 "iris_threshold", "upper_threshold", "lower_threshold",
+                 "sclera_path", "cache_dir", "mesh_cache", "iris_meshes",
+                 "upper_meshes", "lower_meshes", "prev_pupil_scale",
+                 "time_of_last_blink", "time_to_next_blink", "draw",
+                 "timer", "detail", "shared_gaze")
+
+    def __init__(self, svg_file, radius, shader, iris_map, sclera_map,
+                 lid_map, regen_fraction=0.25, autoblink=True, tracking=True,
+                 blink_range=(0.035, 0.06), tracking_range=(0.4, 60.0),
+                 autonomous=True, mesh_cache_kb=0, draw=None,
+                 timer=None, detail=DEFAULT_DETAIL):
+        self.radius = radius
+        self.shader = shader
+        self.iris_map = iris_map
+        self.sclera_map = sclera_map
+        self.lid_map = lid_map
+        self.autoblink = autoblink
+        self.tracking = tracking
+        self.blink_range = blink_range
+        self.tracking_range = tracking_range
+        self.autonomous = autonomous
+        self.draw = draw
+        self.timer = timer or NULL_TIMER
+        self.detail = detail
+        self.eyes = []
+        self.gazes = []
+        self.shared_gaze = None # Gaze of eyes added without one
+
+        # Extract SVG paths as point lists scaled to eye dimensions
+        self.cache_dir = default_cache_dir(svg_file)
+        pts = load_eye_points(svg_file, radius,
+                              eye_paths(detail.iris_points, detail.lid_points))
+        self.pupil_min = pts["pupilMin"]
+        self.pupil_max = pts["pupilMax"]
+        self.iris_pts = pts["iris"]
+        self.upper_open = pts["upperLidOpen"]
+        self.upper_closed = pts["upperLidClosed"]
+        self.upper_edge = pts["upperLidEdge"]
+        self.lower_open = pts["lowerLidOpen"]
+        self.lower_closed = pts["lowerLidClosed"]
+        self.lower_edge = pts["lowerLidEdge"]
+        self.iris_z = zangle(self.iris_pts, radius)[0] * 0.99 # Iris Z depth
+
+        # Regenerating flexible object geometry (such as eyelids during
+        # blinks, or iris during pupil dilation) is CPU intensive, can
+        # noticably slow things down, especially on single-core boards.
+        # To reduce this load somewhat, determine a size change threshold
+        # below which regeneration will not occur.
+
+        # Determine change in pupil size to trigger iris geometry regen
+        self.iris_threshold = 0.0
+        a = points_bounds_array(self.pupil_min) # Bounds of pupil at min size
+        b = points_bounds_array(self.pupil_max) # " at max size
+        max_dist = max(abs(a[0] - b[0]), abs(a[1] - b[1]), # Max variance
+                       abs(a[2] - b[2]), abs(a[3] - b[3])) # around edges
+        # max_dist is motion range in pixels as pupil scales 0.0 to 1.0;
+        # 1.0 / max_dist is one pixel's worth of scale range.
+        if max_dist > 0:
+            self.iris_threshold = regen_fraction / max_dist
+
+        # Eyelids: instead of bounds, the distance between the middle points
+        # of the open and closed eyelid paths is evaluated.
+        self.upper_threshold = self._lid_threshold(
+            self.upper_open, self.upper_closed, regen_fraction)
+        self.lower_threshold = self._lid_threshold(
+            self.lower_open, self.lower_closed, regen_fraction)
+
+        # Optional lookup tables for the regenerated meshes
+        self.mesh_cache = None
+        self.iris_meshes = None
+        self.upper_meshes = None
+        self.lower_meshes = None
+        if mesh_cache_kb > 0:
+            self.mesh_cache = MeshCache(mesh_cache_kb * 1024)
+            self.iris_meshes = IrisMeshes(
+                self.mesh_cache, self.pupil_min, self.pupil_max,
+                self.iris_pts, -self.iris_z, self.iris_threshold,
+                detail.iris_steps)
+            self.upper_meshes = LidMeshes(
+                self.mesh_cache, self.upper_open, self.upper_closed,
+                self.upper_edge, self.upper_threshold, detail.lid_steps)
+            self.lower_meshes = LidMeshes(
+                self.mesh_cache, self.lower_open, self.lower_closed,
+                self.lower_edge, self.lower_threshold, detail.lid_steps)
+
+        # 2D profile lathed to form the scleras
+        angle1 = zangle(pts["scleraFront"], radius)[1] # Sclera front angle
+        angle2 = zangle(pts["scleraBack"], radius)[1]  # " back angle
+        a_range = 180 - angle1 - angle2
+        # ADD EXTRA INITIAL POINT because of some weird behavior with Pi3D
+        # and VideoCore VI with the Lathed shapes. This adds a *tiny* ring
+        # of extra polygons that simply disappear on screen. It's not
+        # necessary on VC4, but not harmful either.
+        ca, sa = pi3d.Utility.from_polar((90 - angle1) + a_range * 0.0001)
+        self.sclera_path = [(ca * radius, sa * radius)]
+        steps = detail.sclera_steps
+        for i in range(steps):
+            ca, sa = pi3d.Utility.from_polar((90 - angle1) -
+                                             a_range * i / (steps - 1))
+            self.sclera_path.append((ca * radius, sa * radius))
+
+        self.prev_pupil_scale = -1.0 # Force regen on first frame
+        self.time_of_last_blink = 0.0
+        self.time_to_next_blink = 1.0
+
+    @staticmethod
+    def _lid_threshold(open_pts, closed_pts, regen_fraction):
+        p1 = open_pts[len(open_pts) // 2]
+        p2 = closed_pts[len(closed_pts) // 2]
+        dx = p2[0] - p1[0]
+        dy = p2[1] - p1[1]
+        d = dx * dx + dy * dy
+        if d > 0:
+            return regen_fraction / math.sqrt(d)
+        return 0.0
+
+    def add_eye(self, x=0.0, flip=False, convergence=0.0, iris_offset=0.0,
+                sclera_offset=0.0, gaze=None):
+        """Add an eye centered 'x' pixels from center of screen. flip
+           mirrors the eyelids (right eye), convergence is added to the Y
+           rotation, iris_offset/sclera_offset shift the texture maps' U
+           axis (0.5 = 180 degrees, so repetition isn't obvious on two
+           eyes). Eyes added without a Gaze share one, separate from any
+           passed in. Returns the new Eye."""
+        if gaze is None:
+            if self.shared_gaze is None:
+                self.shared_gaze = Gaze()
+            gaze = self.shared_gaze
+        if gaze not in self.gazes:
+            self.gazes.append(gaze)
+
+        # Iris and eyelid meshes are set up with texture coordinates here;
+        # geometry is regenerated as needed in update().
+        detail = self.detail
+        iris = mesh_init((detail.iris_points, detail.iris_steps),
+                         (iris_offset, 0.5 / self.iris_map.iy), True, False)
+        iris.set_textures([self.iris_map])
+        iris.set_shader(self.shader)
+        iris.positionX(x)
+
+        lids = []
+        for _ in range(2):
+            lid = mesh_init((detail.lid_points, detail.lid_steps),
+                            (0, 0.5 / self.lid_map.iy), False, True)
+            lid.set_textures([self.lid_map])
+            lid.set_shader(self.shader)
+            lid.positionX(x)
+            lid.positionZ(-self.radius - 42)
+            lids.append(lid)
+        upper = Lid(lids[0], self.upper_open, self.upper_closed,
+                    self.upper_edge, self.upper_threshold, self.upper_meshes,
+                    detail.lid_steps)
+        lower = Lid(lids[1], self.lower_open, self.lower_closed,
+                    self.lower_edge, self.lower_threshold, self.lower_meshes,
+                    detail.lid_steps)
+
+        # Scleras are generated independently (object isn't re-used) so
+        # each may have a different image map offset.
+        sclera = load_sclera(self.sclera_path, detail.sclera_sides,
+                             sclera_offset, self.cache_dir)
+        sclera.set_textures([self.sclera_map])
+        sclera.set_shader(self.shader)
+        sclera.positionX(x)
+
+        eye = Eye(iris, sclera, upper, lower, gaze, convergence, flip)
+        self.eyes.append(eye)
+        return eye
+
+    def update(self, now, inputs):
+        """Advance all animation to time 'now' given this frame's
+           EyeInputs, regenerating iris/lid geometry as needed."""
+        eyes = self.eyes
+        timer = self.timer
+
+        # Eye position
+        for gaze in self.gazes:
+            if inputs.gaze is not None:
+                gaze.set(inputs.gaze[0], inputs.gaze[1])
+            elif self.autonomous:
+                gaze.update(now)
+        timer.mark("update")
+
+        # Regenerate iris geometry only if size changed by >= threshold
+        p = inputs.pupil
+        if abs(p - self.prev_pupil_scale) >= self.iris_threshold:
+            first = eyes[0].iris
+            if self.iris_meshes is not None:
+                mesh_set(first, self.iris_meshes.mesh(p))
+            else:
+                # Interpolate points between min and max pupil sizes, and
+                # generate mesh between interpolated pupil and iris bounds
+                inter_pupil = points_interp_array(self.pupil_min,
+                                                  self.pupil_max, p)
+                mesh_regen(first, (None, inter_pupil, self.iris_pts),
+                           self.detail.iris_steps, -self.iris_z, True)
+            for eye in eyes[1:]: # Same vertices for other eye(s)
+                mesh_set(eye.iris, mesh_vertices(first))
+            self.prev_pupil_scale = p
+            timer.mark("iris")
+            timer.count("iris_regen")
+
+        # Blinking
+        if (self.autoblink and
+                (now - self.time_of_last_blink) >= self.time_to_next_blink):
+            self.time_of_last_blink = now
+            duration = random.uniform(*self.blink_range)
+            for eye in eyes:
+                if eye.blink_state != ENBLINK:
+                    eye.start_blink(now, duration)
+            self.time_to_next_blink = duration * 3 + random.uniform(0.0, 4.0)
+
+        wink = inputs.wink
+        for i, eye in enumerate(eyes):
+            winking = i < len(wink) and wink[i]
+            eye.update_blink(now, inputs.blink or winking, winking)
+
+        if inputs.blink:
+            duration = random.uniform(0.035, 0.06)
+            for eye in eyes:
+                if eye.blink_state == NOBLINK:
+                    eye.start_blink(now, duration)
+
+        # Eyelid position: tracks pupil (if enabled), closed by blink
+        offset, divisor = self.tracking_range
+        for eye in eyes:
+            tracking_pos = eye.tracking_pos
+            if self.tracking:
+                n = offset - eye.gaze.y / divisor
+                if n < 0.0:
+                    n = 0.0
+                elif n > 1.0:
+                    n = 1.0
+                tracking_pos = (tracking_pos * 3.0 + n) * 0.25
+                eye.tracking_pos = tracking_pos
+            n = eye.blink_weight(now)
+            timer.mark("update")
+            if eye.upper.set_weight(tracking_pos + (n * (1.0 - tracking_pos)),
+                                    eye.flip):
+                timer.count("lid_regen")
+            timer.mark("upper_lid")
+            if eye.lower.set_weight((1.0 - tracking_pos) + (n * tracking_pos),
+                                    eye.flip):
+                timer.count("lid_regen")
+            timer.mark("lower_lid")
+
+    def render(self):
+        """Draw all eyes at their current state."""
+        draw = self.draw
+        for eye in self.eyes:
+            x = eye.gaze.x + eye.convergence
+            y = eye.gaze.y
+            for shape in (eye.iris, eye.sclera):
+                shape.rotateToX(y)
+                shape.rotateToY(x)
+                if draw is None:
+                    shape.draw()
+                else:
+                    draw(shape)
+        for eye in self.eyes:
+            for shape in (eye.upper.shape, eye.lower.shape):
+                if draw is None:
+                    shape.draw()
+                else:
+                    draw(shape)
+        self.timer.mark("draw")
+
+    def state_names(self):
+        """Names for the values of state(), e.g. "x1" for the second eye's
+           gaze X."""
+        return ["pupil"] + ["%s%d" % (name, i) for i in range(len(self.eyes))
+                            for name in EYE_STATE]
+
+    def state(self):
+        """Animation state as drawn, a list of floats: pupil scale, then
+           for each eye its EYE_STATE (gaze in degrees, upper and lower lid
+           weights, blink state)."""
+        values = [self.prev_pupil_scale]
+        for eye in self.eyes:
+            values += (eye.gaze.x, eye.gaze.y, eye.upper.weight,
+                       eye.lower.weight, eye.blink_state)
+        return values
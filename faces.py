@@ -1,13 +1,27 @@
 import cv2
+import argparse
 import math
 import pi3d
 import random
 import threading
 import time
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError: # Not on a Pi (e.g. headless on a build box)
+    GPIO = None
 from svg.path import Path, parse_path
 from xml.dom.minidom import parse
 from gfxutil import *
+from background import BackgroundModel
+from capture import CameraCapture, add_source_arguments, source_from_args
+from detector import FaceDetector
+from eyerig import EyeInputs, EyeRig, RIG_COUNTERS, RIG_STAGES
+from frametimer import add_timing_arguments, timer_from_args
+from governor import ActivityGovernor
+from headless import HeadlessDisplay, HeadlessKeyboard, add_headless_arguments
+from meshcache import add_mesh_cache_arguments
+from meshdetail import add_detail_arguments, detail_from_args
+from predictor import GazePredictor
 
 
 # INPUT CONFIG for eye motion ----------------------------------------------
@@ -21,41 +35,47 @@ TRACKING        = True  # If True, eyelid tracks pupil
 PUPIL_SMOOTH    = 16    # If > 0, filter input from PUPIL_IN
 PUPIL_MIN       = 0.0   # Lower analog range from PUPIL_IN
 PUPIL_MAX       = 1.0   # Upper "
+FACE_MAX_AGE    = 0.5   # Ignore detections on frames older than this (s)
+FACE_PRIORITY   = 1.0   # Follow motion only if no face seen for this (s)
+MOTION_MIN_AREA = 400   # Moving pixels needed to wake the face detector
 BLINK_PIN       = 0    # GPIO pin for blink button
 AUTOBLINK       = True  # If True, eye blinks autonomously
+IDLE_AFTER      = 30.0  # Idle after this long with no target (s, 0 = never)
 
 
 # GPIO initialization ------------------------------------------------------
 
-GPIO.setmode(GPIO.BCM)
+if GPIO is None:
+    BLINK_PIN = -1
+else:
+    GPIO.setmode(GPIO.BCM)
 if BLINK_PIN >= 0: GPIO.setup(BLINK_PIN , GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
 
 
-# Load SVG file, extract paths & convert to point lists --------------------
+# Eye SVG file; paths are extracted once eyeRadius is known ----------------
 
 # Thanks Glen Akins for the symmetrical-lidded cyclops eye SVG!
 # Iris & pupil have been scaled down slightly in this version to compensate
 # for how the WorldEye distorts things...looks OK on WorldEye now but might
 # seem small and silly if used with the regular OLED/TFT code.
-dom               = parse("graphics/cyclops-eye.svg")
-vb                = get_view_box(dom)
-pupilMinPts       = get_points(dom, "pupilMin"      , 32, True , True )
-pupilMaxPts       = get_points(dom, "pupilMax"      , 32, True , True )
-irisPts           = get_points(dom, "iris"          , 32, True , True )
-scleraFrontPts    = get_points(dom, "scleraFront"   ,  0, False, False)
-scleraBackPts     = get_points(dom, "scleraBack"    ,  0, False, False)
-upperLidClosedPts = get_points(dom, "upperLidClosed", 33, False, True )
-upperLidOpenPts   = get_points(dom, "upperLidOpen"  , 33, False, True )
-upperLidEdgePts   = get_points(dom, "upperLidEdge"  , 33, False, False)
-lowerLidClosedPts = get_points(dom, "lowerLidClosed", 33, False, False)
-lowerLidOpenPts   = get_points(dom, "lowerLidOpen"  , 33, False, False)
-lowerLidEdgePts   = get_points(dom, "lowerLidEdge"  , 33, False, False)
+eyeSvg            = "graphics/cyclops-eye.svg"
 
 
 # Set up display and initialize pi3d ---------------------------------------
 
-DISPLAY = pi3d.Display.create(samples=4)
+parser = argparse.ArgumentParser()
+add_headless_arguments(parser) # --headless etc., see headless.py
+add_timing_arguments(parser)   # --timing, see frametimer.py
+add_detail_arguments(parser)   # --detail, see meshdetail.py
+add_mesh_cache_arguments(parser) # --mesh-cache, see meshcache.py
+add_source_arguments(parser)   # --source etc., see capture.py
+args, _ = parser.parse_known_args()
+
+if args.headless:
+    DISPLAY = HeadlessDisplay.from_args(args)
+else:
+    DISPLAY = pi3d.Display.create(samples=4)
 DISPLAY.set_background(0, 0, 0, 1) # r,g,b,alpha
 
 # eyeRadius is the size, in pixels, at which the whole eye will be rendered.
@@ -71,7 +91,7 @@ else:
 # Line of sight is down Z axis, allowing conventional X/Y cartesion
 # coords for 2D positions.
 cam    = pi3d.Camera(is_3d=False, at=(0,0,0), eye=(0,0,-1000))
-shader = pi3d.Shader("uv_light")
+shader = None if args.headless else pi3d.Shader("uv_light")
 light  = pi3d.Light(lightpos=(0, -500, -500), lightamb=(0.2, 0.2, 0.2))
 
 
@@ -88,308 +108,171 @@ lidMap    = pi3d.Texture("graphics/lid.png"   , mipmap=False,
 #              filter=pi3d.constants.GL_LINEAR, blend=False, m_repeat=True)
 
 
+# Per-stage frame timing (--timing), see frametimer.py
+timerStages = ("wait", "camera", "convert", "background", "detect")
+timer = timer_from_args(args, timerStages + RIG_STAGES, RIG_COUNTERS)
+
+
 # Initialize static geometry -----------------------------------------------
 
-# Transform point lists to eye dimensions
-scale_points(pupilMinPts      , vb, eyeRadius)
-scale_points(pupilMaxPts      , vb, eyeRadius)
-scale_points(irisPts          , vb, eyeRadius)
-scale_points(scleraFrontPts   , vb, eyeRadius)
-scale_points(scleraBackPts    , vb, eyeRadius)
-scale_points(upperLidClosedPts, vb, eyeRadius)
-scale_points(upperLidOpenPts  , vb, eyeRadius)
-scale_points(upperLidEdgePts  , vb, eyeRadius)
-scale_points(lowerLidClosedPts, vb, eyeRadius)
-scale_points(lowerLidOpenPts  , vb, eyeRadius)
-scale_points(lowerLidEdgePts  , vb, eyeRadius)
-
-# Regenerating flexible object geometry (such as eyelids during blinks, or
-# iris during pupil dilation) is CPU intensive, can noticably slow things
-# down, especially on single-core boards.  To reduce this load somewhat,
-# determine a size change threshold below which regeneration will not occur;
-# roughly equal to 1/2 pixel, since 2x2 area sampling is used.
-
-# Determine change in pupil size to trigger iris geometry regen
-irisRegenThreshold = 0.0
-a = points_bounds(pupilMinPts) # Bounds of pupil at min size (in pixels)
-b = points_bounds(pupilMaxPts) # " at max size
-maxDist = max(abs(a[0] - b[0]), abs(a[1] - b[1]), # Determine distance of max
-              abs(a[2] - b[2]), abs(a[3] - b[3])) # variance around each edge
-# maxDist is motion range in pixels as pupil scales between 0.0 and 1.0.
-# 1.0 / maxDist is one pixel's worth of scale range.  Need 1/2 that...
-if maxDist > 0: irisRegenThreshold = 0.5 / maxDist
-
-# Determine change in eyelid values needed to trigger geometry regen.
-# This is done a little differently than the pupils...instead of bounds,
-# the distance between the middle points of the open and closed eyelid
-# paths is evaluated, then similar 1/2 pixel threshold is determined.
-upperLidRegenThreshold = 0.0
-lowerLidRegenThreshold = 0.0
-p1 = upperLidOpenPts[len(upperLidOpenPts) // 2]
-p2 = upperLidClosedPts[len(upperLidClosedPts) // 2]
-dx = p2[0] - p1[0]
-dy = p2[1] - p1[1]
-d  = dx * dx + dy * dy
-if d > 0: upperLidRegenThreshold = 0.5 / math.sqrt(d)
-p1 = lowerLidOpenPts[len(lowerLidOpenPts) // 2]
-p2 = lowerLidClosedPts[len(lowerLidClosedPts) // 2]
-dx = p2[0] - p1[0]
-dy = p2[1] - p1[1]
-d  = dx * dx + dy * dy
-if d > 0: lowerLidRegenThreshold = 0.5 / math.sqrt(d)
-
-# Generate initial iris mesh; vertex elements will get replaced on
-# a per-frame basis in the main loop, this just sets up textures, etc.
-iris = mesh_init((32, 4), (0, 0.5 / irisMap.iy), True, False)
-iris.set_textures([irisMap])
-iris.set_shader(shader)
-irisZ = zangle(irisPts, eyeRadius)[0] * 0.99 # Get iris Z depth, for later
-
-# Eyelid meshes are likewise temporary; texture coordinates are
-# assigned here but geometry is dynamically regenerated in main loop.
-upperEyelid = mesh_init((33, 5), (0, 0.5 / lidMap.iy), False, True)
-upperEyelid.set_textures([lidMap])
-upperEyelid.set_shader(shader)
-lowerEyelid = mesh_init((33, 5), (0, 0.5 / lidMap.iy), False, True)
-lowerEyelid.set_textures([lidMap])
-lowerEyelid.set_shader(shader)
-
-# Generate sclera for eye...start with a 2D shape for lathing...
-angle1 = zangle(scleraFrontPts, eyeRadius)[1] # Sclera front angle
-angle2 = zangle(scleraBackPts , eyeRadius)[1] # " back angle
-aRange = 180 - angle1 - angle2
-pts    = []
-
-# ADD EXTRA INITIAL POINT because of some weird behavior with Pi3D and
-# VideoCore VI with the Lathed shapes we make later. This adds a *tiny*
-# ring of extra polygons that simply disappear on screen. It's not
-# necessary on VC4, but not harmful either, so we just do it rather
-# than try to be all clever.
-ca, sa = pi3d.Utility.from_polar((90 - angle1) + aRange * 0.0001)
-pts.append((ca * eyeRadius, sa * eyeRadius))
-
-for i in range(24):
-    ca, sa = pi3d.Utility.from_polar((90 - angle1) - aRange * i / 23)
-    pts.append((ca * eyeRadius, sa * eyeRadius))
-
-eye = pi3d.Lathe(path=pts, sides=64)
-eye.set_textures([scleraMap])
-eye.set_shader(shader)
-re_axis(eye, 0.0)
+# The eye rig extracts SVG paths (cached by eyeRadius, see svgcache.py),
+# determines regen thresholds of roughly 1/2 pixel, since 2x2 area sampling
+# is used, and builds the iris, sclera and eyelid shapes. Eye position
+# comes from face detection only; there's no autonomous movement.
+rig = EyeRig(eyeSvg, eyeRadius, shader, irisMap, scleraMap, lidMap,
+             regen_fraction=0.5, autoblink=AUTOBLINK, tracking=TRACKING,
+             blink_range=(0.06, 0.12), tracking_range=(0.5, 70.0),
+             autonomous=False,
+             mesh_cache_kb=args.mesh_cache,
+             draw=DISPLAY.draw if args.headless else None,
+             timer=timer, detail=detail_from_args(args, eyeRadius, eyes=1))
+rig.add_eye(0.0)
 
 
 # Init global stuff --------------------------------------------------------
 
-mykeys = pi3d.Keyboard() # For capturing key presses
-
-startX       = random.uniform(-30.0, 30.0)
-n            = math.sqrt(900.0 - startX * startX)
-startY       = random.uniform(-n, n)
-destX        = startX
-destY        = startY
-curX         = startX
-curY         = startY
-moveDuration = random.uniform(0.075, 0.175)
-holdDuration = random.uniform(0.1, 1.1)
-startTime    = 0.0
-isMoving     = False
+# For capturing key presses
+mykeys = HeadlessKeyboard() if args.headless else pi3d.Keyboard()
 
+inputs        = EyeInputs()
 frames        = 0
 beginningTime = time.time()
 
-eye.positionX(0.0)
-iris.positionX(0.0)
-upperEyelid.positionX(0.0)
-upperEyelid.positionZ(-eyeRadius - 42)
-lowerEyelid.positionX(0.0)
-lowerEyelid.positionZ(-eyeRadius - 42)
+currentPupilScale = 0.5
+
+# Load the cascade. Detection runs in its own process, off the render
+# thread. The cascade runs every 5th camera frame (or when the face is
+# lost) and the face is followed by optical flow in between; each cascade
+# run uses a half-size copy of the frame, searching near the last face
+# found with a full scan every 10 runs (see detector.py). Faces smaller
+# than 60 pixels across (in the full frame) are ignored.
+face_detector = FaceDetector('haarcascade_frontalface_default.xml', 1.1, 4,
+                             detect_interval=5, scale=0.5, min_size=60,
+                             roi_pad=0.5, full_scan_interval=10)
+lastDetection = 0 # seq of last detector result used
+lastFaceTime  = 0.0 # Capture time of last frame with a face in it
+
+# The cheap motion stage runs on every camera frame, and frames only go
+# to the face detector while something is moving or a face was recently
+# seen, so in an empty room detection costs next to nothing. Until a
+# face is found, the eye follows the motion instead (see background.py).
+background = BackgroundModel("average", rate=0.05, levels=2, threshold=10)
+
+# Smooths the detected target and extrapolates it to the time each frame
+# is drawn, to hide detection latency (see predictor.py). Works in eye
+# rotation degrees here, since faces and motion map to the eye
+# differently, hence the higher beta than with camera pixels.
+predictor = GazePredictor(beta=0.4)
 
-currentPupilScale  =  0.5
-prevPupilScale     = -1.0 # Force regen on first frame
-prevUpperLidWeight = 0.5
-prevLowerLidWeight = 0.5
-prevUpperLidPts    = points_interp(upperLidOpenPts, upperLidClosedPts, 0.5)
-prevLowerLidPts    = points_interp(lowerLidOpenPts, lowerLidClosedPts, 0.5)
 
-ruRegen = True
-rlRegen = True
+def faceGaze(x, y, w, h):
+    # Eye position (degrees) to look at a face box
+    return (((200 + (x+w)/2)/4) + 270, ((100 - (y+h)/2)/4))
 
-timeOfLastBlink = 0.0
-timeToNextBlink = 1.0
-blinkState      = 0
-blinkDuration   = 0.1
-blinkStartTime  = 0
 
-trackingPos = 0.3
+def motionGaze(x, y):
+    # Eye position (degrees) to look at a motion centre, as in motion3.py
+    return (((320 + x)/6) + 260, ((240 - y)/6))
 
-# Load the cascade
-face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+# To capture video from webcam (or a video file, image directory or
+# synthetic test pattern, see --source). Frames are read in a separate
+# thread (see capture.py) so the eyes render at display rate regardless
+# of the camera's frame rate.
+camera = CameraCapture(source_from_args(args), args.pace, daemon=True)
+camera.start()
+lastCameraFrame = 0 # seq of last camera frame processed
 
-# To capture video from webcam. 
-cap = cv2.VideoCapture(0)
-# To use a video file as input 
-# cap = cv2.VideoCapture('filename.mp4')
+# Drops to a low camera and render rate after IDLE_AFTER seconds with
+# nothing to look at, and back at the first motion (see governor.py)
+governor = ActivityGovernor(DISPLAY, camera, idle_after=IDLE_AFTER)
 
 
 # Generate one frame of imagery
 def frame(p):
 
-    global startX, startY, destX, destY, curX, curY
-    global moveDuration, holdDuration, startTime, isMoving
-    global frames
-    global iris
-    global pupilMinPts, pupilMaxPts, irisPts, irisZ
-    global eye
-    global upperEyelid, lowerEyelid
-    global upperLidOpenPts, upperLidClosedPts, lowerLidOpenPts, lowerLidClosedPts
-    global upperLidEdgePts, lowerLidEdgePts
-    global prevUpperLidPts, prevLowerLidPts
-    global prevUpperLidWeight, prevLowerLidWeight
-    global prevPupilScale
-    global irisRegenThreshold, upperLidRegenThreshold, lowerLidRegenThreshold
-    global luRegen, llRegen, ruRegen, rlRegen
-    global timeOfLastBlink, timeToNextBlink
-    global blinkState
-    global blinkDuration
-    global blinkStartTime
-    global trackingPos
+    global frames, lastCameraFrame, lastDetection, lastFaceTime
 
+    timer.start_frame()
     DISPLAY.loop_running()
+    timer.mark("wait")
 
     now = time.time()
-    dt  = now - startTime
 
     frames += 1
 #	if(now > beginningTime):
 #		print(frames/(now-beginningTime))
 
 
-    # Read the frame
-    _, img = cap.read()
-
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    # Detect the faces
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-    # Draw the rectangle around each face
-
-    for (x, y, w, h) in faces:
-        print((x+w)/2, (y+h)/2)
-
-        # Eye position from analog inputs
-        curX = ((200 + (x+w)/2)/4) + 270
-        curY = ((100 - (y+h)/2)/4)
-
-    # Regenerate iris geometry only if size changed by >= 1/2 pixel
-    if abs(p - prevPupilScale) >= irisRegenThreshold:
-        # Interpolate points between min and max pupil sizes
-        interPupil = points_interp(pupilMinPts, pupilMaxPts, p)
-        # Generate mesh between interpolated pupil and iris bounds
-        mesh = points_mesh((None, interPupil, irisPts), 4, -irisZ, True)
-        iris.re_init(pts=mesh)
-        prevPupilScale = p
-
-    # Eyelid WIP
-
-    if AUTOBLINK and (now - timeOfLastBlink) >= timeToNextBlink:
-        # Similar to movement, eye blinks are slower in this version
-        timeOfLastBlink = now
-        duration        = random.uniform(0.06, 0.12)
-        if blinkState != 1:
-            blinkState     = 1 # ENBLINK
-            blinkStartTime = now
-            blinkDuration  = duration
-        timeToNextBlink = duration * 3 + random.uniform(0.0, 4.0)
-
-    if blinkState: # Eye currently winking/blinking?
-        # Check if blink time has elapsed...
-        if (now - blinkStartTime) >= blinkDuration:
-            # Yes...increment blink state, unless...
-            if (blinkState == 1 and # Enblinking and...
-                (BLINK_PIN >= 0 and    # blink pin held
-                 GPIO.input(BLINK_PIN) == GPIO.LOW)):
-                # Don't advance yet; eye is held closed
-                pass
-            else:
-                blinkState += 1
-                if blinkState > 2:
-                    blinkState = 0 # NOBLINK
-                else:
-                    blinkDuration *= 2.0
-                    blinkStartTime = now
-    else:
-        if BLINK_PIN >= 0 and GPIO.input(BLINK_PIN) == GPIO.LOW:
-            blinkState     = 1 # ENBLINK
-            blinkStartTime = now
-            blinkDuration  = random.uniform(0.035, 0.06)
-
-    if TRACKING:
-        # 0 = fully up, 1 = fully down
-        n = 0.5 - curY / 70.0
-        if   n < 0.0: n = 0.0
-        elif n > 1.0: n = 1.0
-        trackingPos = (trackingPos * 3.0 + n) * 0.25
-
-    if blinkState:
-        n = (now - blinkStartTime) / blinkDuration
-        if n > 1.0: n = 1.0
-        if blinkState == 2: n = 1.0 - n
-    else:
-        n = 0.0
-    newUpperLidWeight = trackingPos + (n * (1.0 - trackingPos))
-    newLowerLidWeight = (1.0 - trackingPos) + (n * trackingPos)
-
-    if (ruRegen or (abs(newUpperLidWeight - prevUpperLidWeight) >=
-      upperLidRegenThreshold)):
-        newUpperLidPts = points_interp(upperLidOpenPts,
-          upperLidClosedPts, newUpperLidWeight)
-        if newUpperLidWeight > prevUpperLidWeight:
-            upperEyelid.re_init(pts=points_mesh(
-              (upperLidEdgePts, prevUpperLidPts,
-              newUpperLidPts), 5, 0, False))
-        else:
-            upperEyelid.re_init(pts=points_mesh(
-              (upperLidEdgePts, newUpperLidPts,
-              prevUpperLidPts), 5, 0, False))
-        prevUpperLidWeight = newUpperLidWeight
-        prevUpperLidPts    = newUpperLidPts
-        ruRegen = True
-    else:
-        ruRegen = False
-
-    if (rlRegen or (abs(newLowerLidWeight - prevLowerLidWeight) >=
-      lowerLidRegenThreshold)):
-        newLowerLidPts = points_interp(lowerLidOpenPts,
-          lowerLidClosedPts, newLowerLidWeight)
-        if newLowerLidWeight > prevLowerLidWeight:
-            lowerEyelid.re_init(pts=points_mesh(
-              (lowerLidEdgePts, prevLowerLidPts,
-              newLowerLidPts), 5, 0, False))
-        else:
-            lowerEyelid.re_init(pts=points_mesh(
-              (lowerLidEdgePts, newLowerLidPts,
-              prevLowerLidPts), 5, 0, False))
-        prevLowerLidWeight = newLowerLidWeight
-        prevLowerLidPts    = newLowerLidPts
-        rlRegen = True
-    else:
-        rlRegen = False
-
-    # Draw eye
-
-    iris.rotateToX(curY)
-    iris.rotateToY(curX)
-    iris.draw()
-    eye.rotateToX(curY)
-    eye.rotateToY(curX)
-    eye.draw()
-    upperEyelid.draw()
-    lowerEyelid.draw()
+    governor.update(now)
+
+    # Newest camera frame, if one arrived since the last detection;
+    # otherwise gaze holds and the eyes just keep animating
+    latest = camera.latest(lastCameraFrame)
+    timer.mark("camera")
+    if latest is not None:
+        lastCameraFrame, captureTime, img = latest
+
+        # Convert to grayscale
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        timer.mark("convert")
+
+        # Anything moving?
+        motion = background.target(background.apply(gray), largest=True)
+        timer.mark("background")
+        if motion is not None and motion[2] < MOTION_MIN_AREA:
+            motion = None
+
+        # Hand it to the detector process if so, or if still following
+        # a face (someone sitting still)
+        faceRecent = captureTime - lastFaceTime < FACE_PRIORITY
+        if motion is not None or faceRecent:
+            face_detector.submit(gray, captureTime)
+
+        if motion is not None:
+            governor.activity(now)
+
+        # Follow the motion until there's a face to look at
+        if motion is not None and not faceRecent:
+            predictor.observe(*motionGaze(motion[0], motion[1]),
+                              captureTime, "motion")
+
+    # Use the newest detection result, unless it's from an old frame
+    # (detector fell behind or stalled). Faces take priority over motion.
+    detection = face_detector.latest(lastDetection)
+    timer.mark("detect")
+    if detection is not None:
+        lastDetection, detectTime, faces = detection
+        if now - detectTime > FACE_MAX_AGE:
+            faces = ()
+
+        for (x, y, w, h) in faces:
+            print((x+w)/2, (y+h)/2)
+
+        if len(faces):
+            # Face position into the predictor. Motion seen since that
+            # frame was captured doesn't make it stale (see predictor.py).
+            predictor.observe(*faceGaze(*faces[-1]), detectTime, "face")
+            lastFaceTime = detectTime
+            governor.activity(now)
+
+    # Eye position, predicted forward to now; held where last seen if
+    # the target is lost
+    predicted = predictor.predict(now)
+    if predicted is not None:
+        inputs.gaze = predicted
+
+    inputs.pupil = p
+    inputs.blink = BLINK_PIN >= 0 and GPIO.input(BLINK_PIN) == GPIO.LOW
+
+    rig.update(now, inputs)
+    rig.render()
+    timer.end_frame()
 
     k = mykeys.read()
     if k==27:
         mykeys.close()
+        camera.stop()
+        face_detector.close()
         DISPLAY.stop()
         exit(0)
 
@@ -0,0 +1,158 @@
+"""Per-stage frame timing. Each frame, the entry point and EyeRig mark the
+   end of each stage (display wait, camera read, detection, animation
+   update, iris and eyelid regen, draw calls); the time since the previous
+   mark is charged to that stage. Rows go into a preallocated ring buffer
+   (one per frame, last 'capacity' frames kept), and every 'interval'
+   seconds a summary of p50/p95/p99 per stage and regen counts since the
+   last summary is printed, so a dropped frame can be pinned on the
+   detector or on mesh regeneration; the frames since the last one are
+   summarized at exit. Enable with --timing [FILE]:
+
+       python3 eyes.py --timing
+       python3 faces.py --timing /tmp/timing.log --timing-interval 30
+"""
+
+import atexit
+import sys
+import time
+import numpy as np
+
+
+def add_timing_arguments(parser):
+    """Add the timing options to an entry point's ArgumentParser."""
+    parser.add_argument("--timing", nargs="?", const="-", metavar="FILE",
+                        help="print per-stage frame timing (to FILE if given)")
+    parser.add_argument("--timing-interval", type=float, default=10.0,
+                        help="seconds between timing summaries")
+
+
+def timer_from_args(args, stages, counters=()):
+    """FrameTimer for the options added by add_timing_arguments(), or NULL_TIMER
+       if timing wasn't requested."""
+    if not args.timing:
+        return NULL_TIMER
+    out = sys.stdout if args.timing == "-" else open(args.timing, "a")
+    return FrameTimer(stages, counters, interval=args.timing_interval, out=out)
+
+
+class FrameTimer(object):
+    """Stage timer and summary printer; see module notes. stages and
+       counters are sequences of names, fixed up front so the ring buffer
+       can be allocated once."""
+
+    def __init__(self, stages, counters=(), capacity=1024, interval=10.0,
+                 out=None):
+        self.stages = tuple(stages)
+        self.counters = tuple(counters)
+        self.capacity = capacity
+        self.interval = interval
+        self.out = out or sys.stdout
+        self._stage = {name: i for i, name in enumerate(self.stages)}
+        self._counter = {name: i for i, name in enumerate(self.counters)}
+        # Last column of times is the whole frame
+        self.times = np.zeros((capacity, len(self.stages) + 1),
+                              dtype=np.float32)
+        self.counts = np.zeros((capacity, len(self.counters)),
+                               dtype=np.int32)
+        self.frames = 0 # Frames completed
+        # Current frame's slots, zeroed in place each frame from the
+        # zero tuples, so the timed loop allocates no new lists
+        self._frame_times = [0.0] * len(self.stages)
+        self._frame_counts = [0] * len(self.counters)
+        self._zero_times = tuple(self._frame_times)
+        self._zero_counts = tuple(self._frame_counts)
+        self._start = self._last = time.perf_counter()
+        self._report_frame = 0
+        self._report_time = None
+        atexit.register(self.stop)
+
+    def start_frame(self):
+        """Begin timing a frame."""
+        self._frame_times[:] = self._zero_times
+        self._frame_counts[:] = self._zero_counts
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Charge time since the previous mark (or frame start) to stage.
+           A stage may be marked several times a frame (e.g. once per eye);
+           its times add up."""
+        now = time.perf_counter()
+        self._frame_times[self._stage[stage]] += now - self._last
+        self._last = now
+
+    def count(self, counter, n=1):
+        """Add n to a per-frame counter (e.g. geometry regens)."""
+        self._frame_counts[self._counter[counter]] += n
+
+    def end_frame(self):
+        """Store this frame's row, and print a summary if one is due."""
+        now = time.perf_counter()
+        row = self.frames % self.capacity
+        self.times[row, :-1] = self._frame_times
+        self.times[row, -1] = now - self._start
+        if self.counters:
+            self.counts[row] = self._frame_counts
+        self.frames += 1
+        if self._report_time is None:
+            self._report_time = now
+        elif now - self._report_time >= self.interval:
+            self.report(now)
+
+    def summary(self, now=None):
+        """Text summary of frames since the last report (at most the last
+           'capacity' frames)."""
+        now = time.perf_counter() if now is None else now
+        n = min(self.frames - self._report_frame, self.capacity)
+        if n <= 0:
+            return "no frames"
+        rows = np.arange(self.frames - n, self.frames) % self.capacity
+        times = self.times[rows] * 1000.0
+        p50, p95, p99 = np.percentile(times, (50, 95, 99), axis=0)
+        elapsed = now - self._report_time if self._report_time else 0.0
+        lines = ["%d frames%s" % (n, " (%.1f fps)" % (
+            (self.frames - self._report_frame) / elapsed) if elapsed else "")]
+        if self.counters:
+            totals = self.counts[rows].sum(axis=0)
+            lines.append("  " + "  ".join(
+                "%s %d" % c for c in zip(self.counters, totals.tolist())))
+        lines.append("  %-10s %8s %8s %8s" % ("ms", "p50", "p95", "p99"))
+        for i, name in enumerate(self.stages + ("frame",)):
+            lines.append("  %-10s %8.3f %8.3f %8.3f" % (
+                name, p50[i], p95[i], p99[i]))
+        return "\n".join(lines)
+
+    def report(self, now=None):
+        """Print summary and start a new reporting period."""
+        now = time.perf_counter() if now is None else now
+        print(self.summary(now), file=self.out)
+        self.out.flush()
+        self._report_frame = self.frames
+        self._report_time = now
+
+    def stop(self):
+        """Print a last summary of any frames not yet reported (called at
+           exit)."""
+        if self.frames > self._report_frame:
+            self.report()
+
+
+class NullTimer(object):
+    """FrameTimer stand-in when timing is off; every call is a no-op."""
+
+    def start_frame(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -1,9 +1,14 @@
 """Utility functions used by the eyes code, related to 2D SGV paths and
    3D pi3d geometry."""
 
+import ctypes
+import io
 import math
+import numpy as np
 import pi3d
-from svg.path import parse_path
+from pi3d.constants import opengles, GL_ARRAY_BUFFER, GLfloat, GLintptr
+from svg.path import parse_path, Arc, CubicBezier, Move, QuadraticBezier
+from xml.etree import ElementTree
 
 def get_view_box(root):
     """Get artboard bounds (to use Illustrator terminology)
@@ -33,27 +38,139 @@ def get_path(root, path_name):
     return None
 
 
-def path_to_points(path, num_points, closed, reverse):
-    """Convert SVG path to a 2D point list. Provide path, number of points,
-       and whether or not this is a closed path (loop). For closed loops,
-       the size of the point list returned is one element larger than the
-       number of points passed, and the first and last elements will
-       coincide."""
-    points = []
+class SvgEyeDocument(object):
+    """Index of the named paths and view box in an SVG file, built in a
+       single streaming pass (ElementTree.iterparse) rather than walking
+       a DOM tree once per lookup as get_path()/get_view_box() do. Pass a
+       filename, file object or bytes. Path data is only parsed (with
+       svg.path) the first time each path is requested."""
+
+    def __init__(self, source):
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        self.view_box = None
+        self._path_data = {}
+        self._paths = {}
+        # Elements are handled on their closing tag, same depth-first
+        # order get_path() and get_view_box() search in, then discarded.
+        for _, elem in ElementTree.iterparse(source, events=("end",)):
+            tag = elem.tag.rsplit("}", 1)[-1].lower()
+            if tag == "path":
+                path_id = elem.get("id")
+                if path_id and path_id not in self._path_data:
+                    self._path_data[path_id] = elem.get("d")
+            elif tag == "svg" and self.view_box is None:
+                view_box = elem.get("viewBox")
+                if view_box:
+                    view_box = view_box.replace(",", " ").split()
+                    self.view_box = tuple(float(v) for v in view_box[:4])
+            elem.clear()
+
+    def __contains__(self, path_name):
+        return path_name in self._path_data
+
+    def names(self):
+        """List of all path IDs found in the document."""
+        return list(self._path_data)
+
+    def get_path(self, path_name):
+        """Parsed svg.path Path for given ID, or None if not present."""
+        path = self._paths.get(path_name)
+        if path is None and path_name in self._path_data:
+            path = parse_path(self._path_data[path_name])
+            self._paths[path_name] = path
+        return path
+
+    def get_points(self, path_name, num_points, closed, reverse):
+        """Same as get_points(), for a path in this document."""
+        return path_to_points(self.get_path(path_name),
+                              num_points, closed, reverse)
+
+    def get_points_array(self, path_name, num_points, closed, reverse):
+        """Same as get_points_array(), for a path in this document."""
+        return path_to_array(self.get_path(path_name), num_points, closed,
+                             reverse).astype(np.float32)
+
+
+def segment_to_array(segment, t):
+    """Evaluate a single svg.path segment at an array of positions (0.0
+       to 1.0 along that segment) in closed form. Returns a complex
+       ndarray the same shape as t (real = X, imag = Y)."""
+    if isinstance(segment, CubicBezier):
+        mt = 1.0 - t
+        return (mt * mt * mt * segment.start +
+                3.0 * mt * mt * t * segment.control1 +
+                3.0 * mt * t * t * segment.control2 +
+                t * t * t * segment.end)
+    if isinstance(segment, QuadraticBezier):
+        mt = 1.0 - t
+        return (mt * mt * segment.start +
+                2.0 * mt * t * segment.control +
+                t * t * segment.end)
+    if isinstance(segment, Move) or segment.start == segment.end:
+        return np.full(t.shape, segment.start, dtype=complex)
+    if (isinstance(segment, Arc) and
+            segment.radius.real != 0 and segment.radius.imag != 0):
+        angle = np.radians(segment.theta + segment.delta * t)
+        cosr = math.cos(math.radians(segment.rotation))
+        sinr = math.sin(math.radians(segment.rotation))
+        radius = segment.radius * segment.radius_scale
+        cosa = np.cos(angle) * radius.real
+        sina = np.sin(angle) * radius.imag
+        return ((cosr * cosa - sinr * sina + segment.center.real) +
+                (sinr * cosa + cosr * sina + segment.center.imag) * 1j)
+    # Line, Close, or a degenerate (zero-radius) arc
+    return segment.start + (segment.end - segment.start) * t
+
+
+def path_to_array(path, num_points, closed, reverse, error=1e-5):
+    """Batched equivalent of path_to_points(). Rather than calling
+       path.point() once per sample, all sample positions are mapped to
+       their segments (by fraction of total path length, same as
+       svg.path does) and each segment is evaluated in one NumPy pass.
+       Returns an (N,2) float array; for closed loops N is one larger
+       than num_points and the first and last rows coincide."""
     num_points = max(num_points, 2)
     if closed:
         div = float(num_points)
     else:
         div = float(num_points - 1)
-    for point_num in range(num_points):
-        if reverse:
-            point = path.point(1.0 - point_num / div, error=1e-5)
-        else:
-            point = path.point(point_num / div, error=1e-5)
-        points.append((point.real, point.imag))
+    t = np.arange(num_points) / div
+    if reverse:
+        t = 1.0 - t
+
+    segments = list(path)
+    lengths = np.array([segment.length(error=error) for segment in segments])
+    total = lengths.sum()
+    points = np.empty(num_points, dtype=complex)
+    if total == 0: # Path of length 0 (i.e. a point)
+        points[:] = segment_to_array(segments[0], np.zeros(1))[0]
+    else:
+        fractions = np.cumsum(lengths / total)
+        starts = fractions - lengths / total
+        seg_idx = np.minimum(np.searchsorted(fractions, t, side="right"),
+                             len(segments) - 1)
+        span = fractions[seg_idx] - starts[seg_idx]
+        seg_t = np.divide(t - starts[seg_idx], span,
+                          out=np.zeros_like(t), where=span > 0)
+        seg_t = np.clip(seg_t, 0.0, 1.0)
+        for i in np.unique(seg_idx):
+            mask = seg_idx == i
+            points[mask] = segment_to_array(segments[i], seg_t[mask])
+
     if closed:
-        points.append(points[0])
-    return points
+        points = np.append(points, points[0])
+    return np.column_stack((points.real, points.imag))
+
+
+def path_to_points(path, num_points, closed, reverse):
+    """Convert SVG path to a 2D point list. Provide path, number of points,
+       and whether or not this is a closed path (loop). For closed loops,
+       the size of the point list returned is one element larger than the
+       number of points passed, and the first and last elements will
+       coincide."""
+    return [tuple(point) for point in
+            path_to_array(path, num_points, closed, reverse).tolist()]
 
 
 def get_points(root, path_name, num_points, closed, reverse):
@@ -104,27 +221,70 @@ def points_bounds(points):
     return (min_x, min_y, max_x, max_y)
 
 
-def re_axis(shape, texture_offset):
+def get_points_array(root, path_name, num_points, closed, reverse):
+    """ndarray counterpart to get_points(); returns an (N,2) float32
+       array rather than a list of tuples."""
+    return path_to_array(get_path(root, path_name), num_points, closed,
+                         reverse).astype(np.float32)
+
+
+def scale_points_array(points, view_box, radius):
+    """In-place scale_points() for an (N,2) float array."""
+    points -= (view_box[0], view_box[1])
+    points /= (view_box[2], view_box[3])
+    points -= 0.5
+    points *= (radius * 2.0, radius * -2.0)
+
+
+def points_interp_array(points1, points2, weight2, out=None):
+    """points_interp() for (N,2) arrays. If 'out' is passed (an array of
+       matching shape), the result is written there instead of allocating
+       a new array."""
+    num_points = min(len(points1), len(points2))
+    if num_points < 1:
+        return None
+    weight2 = min(max(0.0, weight2), 1.0)
+    if out is None:
+        out = np.empty((num_points, 2), dtype=np.float32)
+    np.multiply(points1[:num_points], 1.0 - weight2, out=out)
+    out += points2[:num_points] * weight2
+    return out
+
+
+def points_bounds_array(points):
+    """points_bounds() for an (N,2) array."""
+    min_xy = points.min(axis=0)
+    max_xy = points.max(axis=0)
+    return (float(min_xy[0]), float(min_xy[1]),
+            float(max_xy[0]), float(max_xy[1]))
+
+
+def re_axis(shapes, texture_offset):
     """Rotates a model 90 degrees on the X axis and applies an offset to
        the texture map's U axis. pi3d.Lathe() operates around the Y axis,
        but the eyes need symmetry around the Z axis and applying that
        transformation along with the eye rotation produced undesirable
        motion paths. This is a hacky workaround. It messes around with
        some pi3d data structures directly that it probably shouldn't,
-       and might break with future releases of that code."""
-    # vertices = buf[0,1,2]
-    # normals = buf[3,4,5]
-    # tex_coords = buf[6,7,8]
-    abuf = shape.buf[0].array_buffer
-    for vertex_num, _ in enumerate(abuf):
-        # Rotate vertex
-        abuf[vertex_num][1], abuf[vertex_num][2] = (
-            abuf[vertex_num][2], -abuf[vertex_num][1])
-        # Rotate normal
-        abuf[vertex_num][4], abuf[vertex_num][5] = (
-            abuf[vertex_num][5], -abuf[vertex_num][4])
-        # Offset texture map on U axis
-        abuf[vertex_num][6] += texture_offset
+       and might break with future releases of that code. Accepts a
+       single shape or a list of shapes; every buffer of each is
+       transformed with whole-array operations."""
+    if not isinstance(shapes, (list, tuple)):
+        shapes = (shapes,)
+    for shape in shapes:
+        for buf in shape.buf:
+            # vertices = buf[0,1,2]
+            # normals = buf[3,4,5]
+            # tex_coords = buf[6,7]
+            abuf = buf.array_buffer
+            # Rotate vertex: (y, z) = (z, -y)
+            abuf[:, [1, 2]] = abuf[:, [2, 1]]
+            abuf[:, 2] *= -1.0
+            if abuf.shape[1] >= 6: # Rotate normal likewise
+                abuf[:, [4, 5]] = abuf[:, [5, 4]]
+                abuf[:, 5] *= -1.0
+            if abuf.shape[1] >= 8: # Offset texture map on U axis
+                abuf[:, 6] += texture_offset
 
 
 
@@ -179,6 +339,45 @@ def mesh_init(uv_steps, uv_offset, closed, lid):
     return shape
 
 
+def mesh_vertices(shape):
+    """Writable (N,3) view of the vertex positions inside a shape's own
+       vertex buffer (e.g. one from mesh_init()). Normals, texture
+       coordinates and indices sharing that buffer are left untouched by
+       writes through it. Call mesh_upload() after changing it."""
+    return shape.buf[0].array_buffer[:, 0:3]
+
+
+def mesh_upload(shape):
+    """Push a shape's vertex buffer to its existing OpenGL buffer object
+       (glBufferSubData, no reallocation). Before the shape's first draw
+       there's no GL buffer yet; pi3d uploads everything then anyway."""
+    buf = shape.buf[0]
+    if not buf.opengl_loaded:
+        return
+    buf._select()
+    opengles.glBufferSubData(GL_ARRAY_BUFFER, GLintptr(0),
+                             buf.array_buffer.nbytes,
+                             buf.array_buffer.ctypes.data_as(
+                                 ctypes.POINTER(GLfloat)))
+
+
+def mesh_set(shape, pts):
+    """In-place alternative to shape.re_init(pts=pts): copy vertex
+       positions (an (N,3) array, such as a cached mesh) into the shape's
+       persistent buffer and upload it."""
+    mesh_vertices(shape)[:len(pts)] = pts
+    mesh_upload(shape)
+
+
+def mesh_regen(shape, points, steps, z_coord, flip=False):
+    """In-place alternative to shape.re_init(pts=points_mesh(...)):
+       generates the mesh vertices straight into the shape's persistent
+       buffer (no intermediate vertex list or array) and uploads it.
+       Arguments are the same as points_mesh()/points_mesh_array()."""
+    points_mesh_array(points, steps, z_coord, flip, out=mesh_vertices(shape))
+    mesh_upload(shape)
+
+
 def points_mesh(points, steps, z_coord, flip=False):
     """Generate mesh between two point lists. U axis steps are determined
        by number of points, V axis determined by 'steps'"""
@@ -213,6 +412,37 @@ def points_mesh(points, steps, z_coord, flip=False):
     return verts
 
 
+def points_mesh_array(points, steps, z_coord, flip=False, out=None):
+    """points_mesh() for (N,2) arrays, returning an (M,3) float32 vertex
+       array with the same ordering. All V steps are interpolated in a
+       single broadcast operation. If 'out' is passed (an array of the
+       right size), vertices are written there instead."""
+    steps = max(steps, 2)
+    edge, points1, points2 = points
+    num_points = min(len(points1), len(points2))
+    if num_points < 1:
+        return None
+
+    weights = np.linspace(0.0, 1.0, steps, dtype=np.float32)[:, None, None]
+    rows = (points1[:num_points] * (1.0 - weights) +
+            points2[:num_points] * weights)
+    if edge is None:
+        edge = points1[:0]
+    if flip is True:
+        edge = edge[::-1]
+        rows = rows[:, ::-1]
+
+    num_edge = len(edge)
+    if out is None:
+        out = np.empty((num_edge + steps * num_points, 3), dtype=np.float32)
+    out[:num_edge, 0:2] = edge
+    out[num_edge:, 0:2] = rows.reshape(-1, 2)
+    out[:, 2] = z_coord
+    if flip is True:
+        out[:, 0] *= -1.0
+    return out
+
+
 def zangle(points, eye_radius):
     """Determines the Z depth and angle-from-Z axis of an SVG feature
        (ostensibly a circle, polygonalized by get_points()); for example,
@@ -0,0 +1,58 @@
+"""Idle power mode for the camera-driven eyes. A prop can sit in an empty
+   room for hours, with the camera thread, the detectors and the renderer
+   all running flat out for nobody. ActivityGovernor watches for targets
+   (the entry point calls activity() whenever motion or a face is found)
+   and after idle_after seconds with none, caps the camera read rate,
+   which in turn thins out detection, and the render rate. The first
+   target seen restores full rate on that same frame.
+
+       governor = ActivityGovernor(DISPLAY, camera, idle_after=30.0)
+       ...
+       governor.update(now)   # Each frame
+       governor.activity(now) # When there's something to look at
+"""
+
+
+class ActivityGovernor(object):
+    """Switches display and camera between full rate and idle rate (see
+       module notes). idle_fps caps rendering through the display's
+       frames_per_second, idle_camera_fps caps frames read by a
+       capture.CameraCapture. idle_after of 0 disables idling."""
+
+    def __init__(self, display, camera=None, idle_after=30.0, idle_fps=15.0,
+                 idle_camera_fps=4.0):
+        self.display = display
+        self.camera = camera
+        self.idle_after = idle_after
+        self.idle_fps = idle_fps
+        self.idle_camera_fps = idle_camera_fps
+        self.active_fps = display.frames_per_second # 0 = free running
+        self.idle = False
+        self.last_activity = None
+        self.idle_since = 0.0
+        self.idle_time = 0.0 # Total seconds spent idle, for tuning
+
+    def activity(self, now):
+        """Something to look at: stay (or go back) to full rate."""
+        self.last_activity = now
+        if self.idle:
+            self.idle_time += now - self.idle_since
+            self._set_idle(False)
+
+    def update(self, now):
+        """Go idle if nothing's been seen for idle_after seconds. Returns
+           True while idle."""
+        if self.last_activity is None:
+            self.last_activity = now
+        elif (not self.idle and self.idle_after and
+                now - self.last_activity >= self.idle_after):
+            self.idle_since = now
+            self._set_idle(True)
+        return self.idle
+
+    def _set_idle(self, idle):
+        self.idle = idle
+        self.display.frames_per_second = (self.idle_fps if idle else
+                                          self.active_fps)
+        if self.camera is not None:
+            self.camera.max_fps = self.idle_camera_fps if idle else 0.0
@@ -0,0 +1,299 @@
+"""Headless stand-ins for pi3d's Display and Keyboard, so the entry points
+   can run their usual frame() logic on a build box with no display or
+   GPU (benchmarking, regression tests). Geometry and animation run just
+   as on a Pi. When frames are written out, drawing goes to a small NumPy
+   rasterizer instead of GL, which textures the iris/sclera/lid meshes
+   (nearest texel, alpha discard and blend) but does no lighting. It's
+   for checking geometry and motion, not a pixel-exact match for the
+   uv_light shader.
+
+       python3 eyes.py --headless --frames 600 --output /tmp/frames
+
+   With fixed_fps set (--fixed-fps, see recorder.py), clock() steps the
+   animation time by exactly 1/fixed_fps per frame instead of following
+   the wall clock, so with the same random seed two runs draw the same
+   frames however fast each one goes.
+"""
+
+import ctypes
+import os
+import sys
+import time
+import numpy as np
+import pi3d
+
+
+def add_headless_arguments(parser):
+    """Add the headless-mode options to an entry point's ArgumentParser."""
+    parser.add_argument("--headless", action="store_true",
+                        help="render offscreen with NumPy; no display/GPU")
+    parser.add_argument("--frames", type=int, default=0,
+                        help="headless: exit after this many frames")
+    parser.add_argument("--output", default="",
+                        help="headless: directory to write frames as PNG")
+    parser.add_argument("--size", default="640x480",
+                        help="headless: frame size, WIDTHxHEIGHT")
+
+
+def model_matrix(shape):
+    """Shape's model matrix (row vector convention), composed the same
+       way as pi3d.Shape.draw()."""
+    m = shape.tr1
+    if shape.rozflg:
+        m = np.dot(shape.roz, m)
+    if shape.roxflg:
+        m = np.dot(shape.rox, m)
+    if shape.royflg:
+        m = np.dot(shape.roy, m)
+    if shape.sclflg:
+        m = np.dot(shape.scl, m)
+    if shape.tr2flg:
+        m = np.dot(shape.tr2, m)
+    return m
+
+
+class Rasterizer(object):
+    """Z-buffered triangle rasterizer for pi3d Shapes. All triangles of a
+       buffer are scan-converted in one vectorized pass: each triangle's
+       rows are split into pixel spans, every covered pixel gets Z and UV
+       from per-triangle planes, then the nearest fragment per pixel is
+       kept."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.color = np.zeros((height, width, 3), dtype=np.uint8)
+        self.depth = np.full((height, width), np.inf, dtype=np.float32)
+        self.background = np.zeros(3, dtype=np.uint8)
+
+    def clear(self):
+        self.color[:] = self.background
+        self.depth[:] = np.inf
+
+    def draw(self, shape, camera=None):
+        camera = camera or pi3d.Camera.instance()
+        if not camera.mtrx_made:
+            camera.make_mtrx()
+        m = np.dot(model_matrix(shape), camera.mtrx)
+        for buf in shape.buf:
+            image = buf.textures[0].image if buf.textures else None
+            self._draw_buffer(buf.array_buffer, buf.element_array_buffer,
+                              m, image)
+
+    @staticmethod
+    def _planes(x, y, area, attrs):
+        """Screen-space gradient and offset of per-vertex attributes: for
+           each (T,3) attribute, a(px, py) = c + gx * px + gy * py within
+           each triangle. Returns (gx, gy, c), each (len(attrs), T)."""
+        a = np.stack(attrs) # (A,T,3)
+        da1 = a[:, :, 1] - a[:, :, 0]
+        da2 = a[:, :, 2] - a[:, :, 0]
+        dx1, dx2 = x[:, 1] - x[:, 0], x[:, 2] - x[:, 0]
+        dy1, dy2 = y[:, 1] - y[:, 0], y[:, 2] - y[:, 0]
+        inv_area = 1.0 / np.where(area != 0, area, 1.0)
+        gx = (da1 * dy2 - da2 * dy1) * inv_area
+        gy = (da2 * dx1 - da1 * dx2) * inv_area
+        c = a[:, :, 0] - gx * x[:, 0] - gy * y[:, 0]
+        return (gx.astype(np.float32), gy.astype(np.float32),
+                c.astype(np.float32))
+
+    def _draw_buffer(self, abuf, indices, m, image):
+        w, h = self.width, self.height
+        clip = np.dot(abuf[:, 0:3], m[0:3]) + m[3]
+        ndc = clip[:, 0:3] / clip[:, 3:4]
+        sx = (ndc[:, 0] + 1.0) * 0.5 * w
+        sy = (1.0 - ndc[:, 1]) * 0.5 * h
+        sz = ndc[:, 2]
+
+        tri = np.asarray(indices, dtype=np.intp).reshape(-1, 3)
+        x = sx[tri] # (T,3)
+        y = sy[tri]
+        area = ((x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) -
+                (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0]))
+        # Pixel rows whose centers each triangle spans
+        r0 = np.clip(np.ceil(y.min(axis=1) - 0.5), 0, h).astype(np.intp)
+        r1 = np.clip(np.floor(y.max(axis=1) - 0.5) + 1, 0, h).astype(np.intp)
+        rows = r1 - r0
+        rows[np.abs(area) < 1e-9] = 0 # Degenerate, or edge-on
+        nrows = int(rows.sum())
+        if nrows == 0:
+            return
+
+        # One entry per (triangle, row): span of pixel centers inside it,
+        # from where the row crosses the triangle's edges
+        t = np.repeat(np.arange(len(tri)), rows)
+        row = r0[t] + (np.arange(nrows) -
+                       np.repeat(np.cumsum(rows) - rows, rows))
+        cy = row + 0.5
+        xl = np.full(nrows, np.inf)
+        xr = np.full(nrows, -np.inf)
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            ya, yb = y[t, a], y[t, b]
+            cross = (np.minimum(ya, yb) <= cy) & (cy <= np.maximum(ya, yb))
+            dy = np.where(yb != ya, yb - ya, 1.0)
+            xc = x[t, a] + (cy - ya) * (x[t, b] - x[t, a]) / dy
+            xl = np.where(cross, np.minimum(xl, xc), xl)
+            xr = np.where(cross, np.maximum(xr, xc), xr)
+        c0 = np.clip(np.ceil(xl - 0.5), 0, w).astype(np.intp)
+        c1 = np.clip(np.floor(xr - 0.5) + 1, 0, w).astype(np.intp)
+        cols = np.maximum(c1 - c0, 0)
+        total = int(cols.sum())
+        if total == 0:
+            return
+
+        # One entry per covered pixel. Z and UV are affine in screen space
+        # (orthographic camera), so each is a per-triangle plane.
+        span = np.repeat(np.arange(nrows), cols)
+        t = t[span]
+        px = c0[span] + (np.arange(total) -
+                         np.repeat(np.cumsum(cols) - cols, cols))
+        py = row[span]
+        cx = (px + 0.5).astype(np.float32)
+        cy = (py + 0.5).astype(np.float32)
+        planes = self._planes(x, y, area, (sz[tri], abuf[tri, 6],
+                                           abuf[tri, 7]))
+        gx, gy, c = (p[:, t] for p in planes)
+        z, u, v = c + gx * cx + gy * cy
+
+        # Texture lookup (nearest, GL_REPEAT wrap)
+        if image is None:
+            rgba = np.full((total, 4), 255, dtype=np.uint8)
+        else:
+            th, tw = image.shape[0:2]
+            tx = (np.floor(u * tw).astype(np.intp)) % tw
+            ty = (np.floor(v * th).astype(np.intp)) % th
+            texels = image[ty, tx].reshape(total, -1)
+            rgba = np.empty((total, 4), dtype=np.uint8)
+            if texels.shape[1] < 3: # Luminance, luminance + alpha
+                rgba[:, 0:3] = texels[:, 0:1]
+            else:
+                rgba[:, 0:3] = texels[:, 0:3]
+            if texels.shape[1] in (2, 4):
+                rgba[:, 3] = texels[:, -1]
+            else:
+                rgba[:, 3] = 255
+            keep = rgba[:, 3] > 1 # Transparent texels are discarded
+            px, py, z, rgba = px[keep], py[keep], z[keep], rgba[keep]
+
+        # Depth test: nearest fragment per pixel, then against z-buffer
+        pixel = py * w + px
+        order = np.lexsort((z, pixel))
+        pixel, z = pixel[order], z[order]
+        first = np.ones(len(pixel), dtype=bool)
+        first[1:] = pixel[1:] != pixel[:-1]
+        pixel, z, rgba = pixel[first], z[first], rgba[order][first]
+        depth = self.depth.reshape(-1)
+        visible = z < depth[pixel]
+        pixel, z, rgba = pixel[visible], z[visible], rgba[visible]
+        depth[pixel] = z
+        color = self.color.reshape(-1, 3)
+        alpha = rgba[:, 3:4].astype(np.float32) * (1.0 / 255.0)
+        color[pixel] = (rgba[:, 0:3] * alpha +
+                        color[pixel] * (1.0 - alpha) + 0.5).astype(np.uint8)
+
+
+class _OpenGLLimits(object):
+    """The DisplayOpenGL attributes pi3d reads when loading textures."""
+
+    def __init__(self, max_texture_size):
+        self.max_texture_size = ctypes.c_int(max_texture_size)
+
+
+class HeadlessDisplay(object):
+    """Enough of pi3d.Display for the entry points: width/height,
+       frames_per_second, set_background(), loop_running() and stop().
+       Registers itself as pi3d's display instance so 2D cameras pick up
+       its dimensions. Each loop_running() call finishes the previous
+       frame (writing it to the output directory, if any) and, once the
+       frame limit is reached, prints the average frame rate and exits.
+       clock() is the animation time (see module notes)."""
+
+    def __init__(self, width=640, height=480, max_frames=0, output=""):
+        self.width = width
+        self.height = height
+        self.near = 1.0
+        self.far = 1000.0
+        self.fov = 45.0
+        self.opengl = _OpenGLLimits(4096)
+        self.textures_dict = {}
+        self.tidy_needed = False
+        self.max_frames = max_frames
+        self.output = output
+        self.rasterize = bool(output) # Also set by readers (screens.py)
+        self.frames_per_second = 0 # As pi3d.Display, 0 = free running
+        self.fixed_fps = 0         # clock() rate, 0 = wall clock
+        self.frame_time = None
+        self.frames = 0
+        self.rasterizer = Rasterizer(width, height)
+        self.start_time = None
+        if output:
+            os.makedirs(output, exist_ok=True)
+        pi3d.Display.Display.INSTANCE = self
+
+    @classmethod
+    def from_args(cls, args):
+        """Create from the options added by add_headless_arguments()."""
+        width, height = (int(n) for n in args.size.lower().split("x"))
+        return cls(width, height, args.frames, args.output)
+
+    def set_background(self, r, g, b, alpha):
+        self.rasterizer.background[:] = (np.array((r, g, b)) * 255 + 0.5)
+
+    def draw(self, shape):
+        """Draw one shape into the current frame (pass to EyeRig). Shapes
+           are only rasterized when frames are being written or read
+           back (rasterize, see screens.py); otherwise the run times
+           animation and geometry work alone, since the rasterizer's
+           cost says nothing about GL's on a Pi."""
+        if self.rasterize:
+            self.rasterizer.draw(shape)
+
+    def loop_running(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+        elif self.output:
+            self.save(os.path.join(self.output,
+                                   "frame%05d.png" % (self.frames - 1)))
+        if self.max_frames and self.frames >= self.max_frames:
+            self.stop()
+            sys.exit(0)
+        if self.rasterize:
+            self.rasterizer.clear()
+        if self.frames_per_second:
+            if self.frame_time is not None:
+                delta = 1.0 / self.frames_per_second - (time.time() -
+                                                        self.frame_time)
+                if delta > 0:
+                    time.sleep(delta)
+            self.frame_time = time.time()
+        self.frames += 1
+        return True
+
+    def clock(self):
+        """Animation time in seconds: time.time(), or with fixed_fps set,
+           the frame count over fixed_fps."""
+        if self.fixed_fps:
+            return self.frames / float(self.fixed_fps)
+        return time.time()
+
+    def save(self, filename):
+        """Write the current frame to an image file."""
+        from PIL import Image
+        Image.fromarray(self.rasterizer.color).save(filename)
+
+    def stop(self):
+        if self.start_time is not None and self.frames:
+            elapsed = time.time() - self.start_time
+            print("%d frames, %.3f s, %.1f fps" % (
+                self.frames, elapsed, self.frames / max(elapsed, 1e-9)))
+            self.start_time = None
+
+
+class HeadlessKeyboard(object):
+    """pi3d.Keyboard stand-in; never reports a key."""
+
+    def read(self):
+        return -1
+
+    def close(self):
+        pass
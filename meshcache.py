@@ -0,0 +1,122 @@
+"""Lookup tables for the eyelid and iris meshes that frame() regenerates.
+   Geometry is only regenerated when a weight moves by the regen threshold
+   (roughly 1/4 pixel), so quantizing weights to that same step leaves a
+   finite set of possible meshes. These are generated on first use and
+   kept in a shared LRU store with a fixed memory budget, so repeated
+   blinks and pupil sweeps become table lookups."""
+
+from collections import OrderedDict
+from gfxutil import points_interp_array, points_mesh_array
+
+
+class MeshCache(object):
+    """LRU store of mesh vertex arrays, shared by any number of
+       IrisMeshes/LidMeshes. Once the arrays held exceed max_bytes, the
+       least recently used are discarded. Arrays handed out are read-only
+       since the same one may be passed to several shapes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._meshes = OrderedDict()
+
+    def __len__(self):
+        return len(self._meshes)
+
+    def get(self, key, build):
+        """Return the mesh stored under key, calling build() to generate
+           (and store) it on a miss."""
+        mesh = self._meshes.get(key)
+        if mesh is not None:
+            self._meshes.move_to_end(key)
+            self.hits += 1
+            return mesh
+        self.misses += 1
+        mesh = build()
+        mesh.flags.writeable = False
+        if mesh.nbytes <= self.max_bytes:
+            self._meshes[key] = mesh
+            self.nbytes += mesh.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self._meshes.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return mesh
+
+    def clear(self):
+        """Discard all stored meshes."""
+        self._meshes.clear()
+        self.nbytes = 0
+
+
+def quantize(weight, step):
+    """Snap a 0.0-1.0 weight to an integer count of regen steps."""
+    if step <= 0:
+        return weight
+    return int(round(weight / step))
+
+
+class IrisMeshes(object):
+    """Iris meshes (pupil interpolated between min and max size, meshed
+       out to the iris edge) keyed by quantized pupil scale."""
+
+    def __init__(self, cache, pupil_min, pupil_max, iris, z_coord, step,
+                 steps=4):
+        self.cache = cache
+        self.pupil_min = pupil_min
+        self.pupil_max = pupil_max
+        self.iris = iris
+        self.z_coord = z_coord
+        self.step = step
+        self.steps = steps # Mesh rows, see meshdetail.py
+
+    def mesh(self, scale):
+        """Vertex array for given pupil scale (0.0 to 1.0)."""
+        q = quantize(scale, self.step)
+        return self.cache.get((self, q), lambda: self._build(q))
+
+    def _build(self, q):
+        scale = q * self.step if self.step > 0 else q
+        pupil = points_interp_array(self.pupil_min, self.pupil_max, scale)
+        return points_mesh_array((None, pupil, self.iris), self.steps,
+                                 self.z_coord, True)
+
+
+class LidMeshes(object):
+    """Eyelid meshes keyed by the quantized pair of lid weights (previous
+       and new position) the mesh spans, plus whether it's flipped for
+       the right eye."""
+
+    def __init__(self, cache, open_pts, closed_pts, edge_pts, step,
+                 steps=5):
+        self.cache = cache
+        self.open_pts = open_pts
+        self.closed_pts = closed_pts
+        self.edge_pts = edge_pts
+        self.step = step
+        self.steps = steps # Mesh rows, see meshdetail.py
+
+    def mesh(self, weight1, weight2, flip):
+        """Vertex array for lid swept between two weights (either order)."""
+        q1 = quantize(weight1, self.step)
+        q2 = quantize(weight2, self.step)
+        if q1 > q2:
+            q1, q2 = q2, q1
+        return self.cache.get((self, q1, q2, flip),
+                              lambda: self._build(q1, q2, flip))
+
+    def _build(self, q1, q2, flip):
+        step = self.step if self.step > 0 else 1.0
+        pts1 = points_interp_array(self.open_pts, self.closed_pts, q1 * step)
+        pts2 = points_interp_array(self.open_pts, self.closed_pts, q2 * step)
+        return points_mesh_array((self.edge_pts, pts1, pts2), self.steps, 0,
+                                 flip)
+
+
+def add_mesh_cache_arguments(parser):
+    """Add the mesh lookup table option to an entry point's
+       ArgumentParser (pass args.mesh_cache to EyeRig's mesh_cache_kb)."""
+    parser.add_argument("--mesh-cache", type=int, default=0,
+                        help="KB of RAM for eyelid/iris mesh tables "
+                             "(0 = off)")
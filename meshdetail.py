@@ -0,0 +1,101 @@
+"""Mesh resolution presets. The point and step counts of the iris, eyelid
+   and sclera meshes were fixed for every screen, tuned for the larger
+   renderings; a 128 pixel OLED eye spent CPU regenerating detail finer
+   than a pixel. A MeshDetail holds all of them, and EyeRig applies one
+   consistently to the SVG path sampling, mesh_init(), the regenerated
+   iris/lid meshes and the sclera lathe.
+
+   choose_detail() takes the coarsest preset whose sclera outline, a
+   polygon of sclera_sides edges, stays within 'tolerance' pixels of the
+   true circle at eyeRadius, then, given a budget, steps down while
+   regenerating every iris and lid mesh in one frame would take longer.
+   The budget is off by default: it's measured at startup, so the choice
+   would vary with CPU load and could miss the SVG cache (svgcache.py
+   prebuilds the radius-only choice).
+
+       python3 eyes.py                          # --detail auto, by radius
+       python3 eyes.py --mesh-budget 2          # ...then by regen time
+       python3 cyclops.py --detail high
+"""
+
+import collections
+import math
+import time
+import numpy as np
+from gfxutil import points_mesh_array
+
+# iris_points: points around pupil and iris (closed paths)
+# lid_points:  points along each eyelid path
+# iris_steps:  mesh rows from pupil to iris edge
+# lid_steps:   mesh rows across the swept eyelid
+# sclera_sides, sclera_steps: lathe sides and profile points of the sclera
+MeshDetail = collections.namedtuple(
+    "MeshDetail", "iris_points lid_points iris_steps lid_steps "
+                  "sclera_sides sclera_steps")
+
+PRESETS = collections.OrderedDict((           # Coarsest first
+    ("low",    MeshDetail(16, 17, 3, 4, 32, 12)),
+    ("medium", MeshDetail(24, 25, 4, 4, 48, 18)),
+    ("high",   MeshDetail(32, 33, 4, 5, 64, 24)), # The original counts
+    ("ultra",  MeshDetail(48, 49, 5, 6, 96, 32))))
+
+DEFAULT_DETAIL = PRESETS["high"]
+
+
+def outline_error(radius, sides):
+    """Largest distance, in pixels, between a circle of the given radius
+       and the inscribed polygon of 'sides' edges."""
+    return radius * (1.0 - math.cos(math.pi / sides))
+
+
+def regen_time(detail, eyes=2, repeat=20):
+    """Measured seconds to regenerate every iris and lid mesh of 'eyes'
+       eyes once (the worst frame, a blink during a pupil change), at
+       this detail."""
+    iris = np.zeros((detail.iris_points + 1, 2), dtype=np.float32)
+    lid = np.zeros((detail.lid_points, 2), dtype=np.float32)
+    iris_out = np.empty((len(iris) * detail.iris_steps, 3), np.float32)
+    lid_out = np.empty((len(lid) * (detail.lid_steps + 1), 3), np.float32)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _ in range(eyes):
+            points_mesh_array((None, iris, iris), detail.iris_steps, 0.0,
+                              True, out=iris_out)
+        for _ in range(2 * eyes):
+            points_mesh_array((lid, lid, lid), detail.lid_steps, 0.0,
+                              out=lid_out)
+    return (time.perf_counter() - start) / repeat
+
+
+def choose_detail(radius, tolerance=0.3, budget_ms=0.0, eyes=2):
+    """MeshDetail for eyes drawn at 'radius' pixels (see module notes).
+       budget_ms of 0 means no time limit."""
+    names = list(PRESETS)
+    index = len(names) - 1
+    for i, name in enumerate(names):
+        if outline_error(radius, PRESETS[name].sclera_sides) <= tolerance:
+            index = i
+            break
+    if budget_ms > 0:
+        while (index > 0 and
+               regen_time(PRESETS[names[index]], eyes) * 1000.0 > budget_ms):
+            index -= 1
+    return PRESETS[names[index]]
+
+
+def add_detail_arguments(parser):
+    """Add the mesh detail options to an entry point's ArgumentParser."""
+    parser.add_argument("--detail", choices=["auto"] + list(PRESETS),
+                        default="auto",
+                        help="mesh resolution; auto picks by eye radius")
+    parser.add_argument("--mesh-budget", type=float, default=0.0,
+                        help="auto: max ms to regenerate all iris and lid "
+                             "meshes in a frame, measured at startup "
+                             "(0 = no limit)")
+
+
+def detail_from_args(args, radius, eyes=2):
+    """MeshDetail for the options added by add_detail_arguments()."""
+    if args.detail != "auto":
+        return PRESETS[args.detail]
+    return choose_detail(radius, budget_ms=args.mesh_budget, eyes=eyes)
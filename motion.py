@@ -2,9 +2,11 @@
 import cv2
 import numpy as np
 import math
+from background import BackgroundModel
 
-# Assigning our static_back to None
-previous_back = None
+# Background model: running average of the camera image at quarter width
+# and height, absorbing changes at 5% per frame (see background.py)
+background = BackgroundModel("average", rate=0.05, levels=2, threshold=20)
   
 # Capturing video
 video = cv2.VideoCapture(0)
@@ -17,27 +19,11 @@ while True:
     # Converting color image to gray_scale image
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
   
-    # Converting gray scale image to GaussianBlur 
-    # so that change can be find easily
-    gray = cv2.GaussianBlur(gray, (21, 21), 0)
-  
-    # In first iteration we assign the value 
-    # of static_back to our first frame
-    if previous_back is None:
-        previous_back = gray
-        continue
-  
-    # Difference between static background 
-    # and current frame(which is GaussianBlur)
-    diff_frame = cv2.absdiff(previous_back, gray)
-  
-    # If change in between static background and
-    # current frame is greater than 30 it will show white color(255)
-    thresh_frame = cv2.threshold(diff_frame, 20, 255, cv2.THRESH_BINARY)[1]
-    thresh_frame = cv2.dilate(thresh_frame, None, iterations = 2)
+    # Motion mask from the difference against the background
+    thresh_frame = background.apply(gray)
   
     # Finding contour of moving object
-    cnts,_ = cv2.findContours(thresh_frame.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnts,_ = cv2.findContours(thresh_frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
   
     # for contour in cnts:
     #     if cv2.contourArea(contour) < 100:
@@ -55,11 +41,13 @@ while True:
         #         largest_countour = contour
 
         (x, y, w, h) = cv2.boundingRect(cnts)
+        cv2.rectangle(thresh_frame, (x, y), (x + w, y + h), (0, 255, 0), 1)
+        # Mask coordinates to camera pixels
+        (x, y, w, h) = (v * background.scale for v in (x, y, w, h))
 
 #        x_center = math.trunc(x + (w/2))
 #        y_center = math.trunc(y + (h/2))
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
-        cv2.rectangle(thresh_frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
 #        cv2.rectangle(frame, (x_center, y_center), (x_center + 1, y_center + 1), (255, 0, 0), 3)
         
     # Displaying image in gray_scale
@@ -75,8 +63,6 @@ while True:
   
     # Displaying color frame with contour of motion of object
     # cv2.imshow("Color Frame", frame)
-  
-    previous_back = gray
 
     key = cv2.waitKey(1)
     # if q entered whole process will stop
@@ -0,0 +1,116 @@
+"""Smoothing and prediction for detector targets. Detections arrive at
+   the camera's rate or slower (the face detector may take several
+   frames), each already some way behind by the time it's drawn, and
+   jittery from frame to frame. Snapping the gaze to each one looked
+   twitchy, and clamping the step size per frame (the old max_move) just
+   made the eyes lag further. GazePredictor runs each axis through a
+   One-Euro filter (smooths hard when the target is still, follows
+   closely when it moves fast) and, every rendered frame, extrapolates
+   the filtered position along the filtered velocity by the time since
+   the detected frame was captured. That latency is measured per frame,
+   so the eyes stay on a moving person at lower detection rates.
+
+       predictor = GazePredictor()
+       predictor.observe(x, y, captureTime) # On each detection
+       x, y = predictor.predict(now)        # Every frame
+
+   One-Euro filter: Casiez, Roussel & Vogel, CHI 2012.
+"""
+
+import math
+
+
+class OneEuroFilter(object):
+    """One-Euro low-pass filter for one value. min_cutoff (Hz) sets the
+       smoothing when still, beta how quickly the cutoff rises with speed
+       (units/s), d_cutoff (Hz) the smoothing of the speed estimate.
+       After each call, dx is the filtered rate of change (units/s)."""
+
+    __slots__ = ("min_cutoff", "beta", "d_cutoff", "x", "dx", "t")
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.dx = 0.0
+        self.t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        """Filter sample x taken at time t (seconds); returns filtered x."""
+        if self.x is None:
+            self.x = x
+            self.t = t
+            return x
+        dt = t - self.t
+        if dt <= 0.0:
+            return self.x
+        dx = (x - self.x) / dt
+        self.dx += self._alpha(self.d_cutoff, dt) * (dx - self.dx)
+        cutoff = self.min_cutoff + self.beta * abs(self.dx)
+        self.x += self._alpha(cutoff, dt) * (x - self.x)
+        self.t = t
+        return self.x
+
+
+class GazePredictor(object):
+    """Filtered, latency-compensated 2D target (see module notes), in
+       whatever units the detector reports (camera pixels in the eye
+       scripts). Extrapolation is capped at max_lead seconds. A target
+       not seen for 'timeout' seconds is held still where it was last
+       seen, and the next detection starts the filters afresh, as does
+       a detection from a different source (see observe())."""
+
+    __slots__ = ("fx", "fy", "max_lead", "timeout", "timestamp", "latency",
+                 "source", "source_times")
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0,
+                 max_lead=0.3, timeout=1.0):
+        self.fx = OneEuroFilter(min_cutoff, beta, d_cutoff)
+        self.fy = OneEuroFilter(min_cutoff, beta, d_cutoff)
+        self.max_lead = max_lead
+        self.timeout = timeout
+        self.timestamp = None # Capture time of last detection
+        self.latency = 0.0    # Capture-to-render time at last predict()
+        self.source = None    # Source of last detection
+        self.source_times = {} # Capture time of last detection, by source
+
+    def observe(self, x, y, timestamp, source=None):
+        """Add a detection at (x, y), from a frame captured at timestamp
+           (time.time() seconds). Detections from frames no newer than the
+           last one observed from the same source are ignored (e.g. a
+           slow detector's result arriving after its own result for a
+           later frame). Sources are any labels, e.g. "face" and "motion":
+           a slow source's result may be older than a quick one's, and
+           switching source restarts the filters from it."""
+        last = self.source_times.get(source)
+        if last is not None and timestamp <= last:
+            return
+        if (source != self.source or self.timestamp is not None and
+                timestamp - self.timestamp > self.timeout):
+            self.fx.reset()
+            self.fy.reset()
+        self.fx(x, timestamp)
+        self.fy(y, timestamp)
+        self.timestamp = timestamp
+        self.source = source
+        self.source_times[source] = timestamp
+
+    def predict(self, now):
+        """Estimated target (x, y) at time now, or None before the first
+           detection."""
+        if self.timestamp is None:
+            return None
+        self.latency = now - self.timestamp
+        if self.latency > self.timeout:
+            return self.fx.x, self.fy.x
+        lead = min(max(self.latency, 0.0), self.max_lead)
+        return self.fx.x + self.fx.dx * lead, self.fy.x + self.fy.dx * lead
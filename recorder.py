@@ -0,0 +1,249 @@
+"""Recording of rendered eye frames, for comparing output before and after
+   a change and for measuring frame timing offline. FrameRecorder appends
+   each frame's per-eye images (RGB565 as sent to the screens, or RGB),
+   its timestamp and the rig's animation state to a preallocated,
+   memory-mapped file: recording a frame is one copy into the page cache,
+   with no encoding or system calls in the render loop. FrameReader maps
+   a recording read-only and only touches the frames actually looked at.
+
+       python3 eyes.py --headless --frames 600 --seed 1 --fixed-fps 30 \
+           --record before.eyes
+       python3 recorder.py before.eyes             # Frame interval jitter
+       python3 recorder.py before.eyes after.eyes  # Differences
+
+   The animation is random and timed by the clock, so two recordings only
+   match frame for frame if both were made with the same --seed and a
+   fixed frame clock (--fixed-fps, headless only; see headless.py). Both
+   are stored in the header, and compare_report() says when they differ.
+   The recorded timestamps stay wall-clock times, for the jitter report.
+
+   File layout: 8-byte magic, frame count (uint64, updated as frames are
+   recorded, so a crashed run can still be read), JSON description, all
+   padded to HEADER_SIZE, then one fixed-size record per frame.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"PIEYREC1"
+HEADER_SIZE = 4096
+
+
+def _record_dtype(info):
+    return np.dtype([("time", "<f8"),
+                     ("state", "<f4", (len(info["state"]),)),
+                     ("frames", np.dtype(info["dtype"]),
+                      tuple([info["eyes"]] + info["shape"]))])
+
+
+class FrameRecorder(object):
+    """Records up to 'capacity' frames to filename. The file is created,
+       at its full size, on the first record(), once the frame size is
+       known; frames beyond capacity are counted in 'overflow' and not
+       recorded. state_names label the state values (see
+       EyeRig.state_names()); run (a dict) is stored as it is, for
+       compare_report() to check ("seed" and "fixed_fps")."""
+
+    def __init__(self, filename, capacity=3600, state_names=(), run=None):
+        self.filename = filename
+        self.capacity = capacity
+        self.state_names = list(state_names)
+        self.run = dict(run or {}) # How frames were made, e.g. seed
+        self.count = 0
+        self.overflow = 0
+        self.records = None
+        self._count = None
+
+    def _create(self, frames):
+        info = {"capacity": self.capacity, "eyes": len(frames),
+                "shape": list(frames[0].shape),
+                "dtype": frames[0].dtype.str, "state": self.state_names,
+                "run": self.run}
+        text = json.dumps(info).encode()
+        if len(text) > HEADER_SIZE - 20:
+            raise ValueError("too many state names for header")
+        dtype = _record_dtype(info)
+        with open(self.filename, "wb") as f:
+            f.write(MAGIC + struct.pack("<QI", 0, len(text)) + text)
+            # Sparse where supported; pages are allocated as frames land
+            f.truncate(HEADER_SIZE + self.capacity * dtype.itemsize)
+        self._count = np.memmap(self.filename, "<u8", "r+", len(MAGIC), (1,))
+        self.records = np.memmap(self.filename, dtype, "r+", HEADER_SIZE,
+                                 (self.capacity,))
+        atexit.register(self.close)
+
+    def record(self, timestamp, frames, state=()):
+        """Add a frame: timestamp (seconds), a sequence of per-eye images
+           (same shape and dtype every frame) and the state values."""
+        if self.records is None:
+            self._create(frames)
+        if self.count >= self.capacity:
+            self.overflow += 1
+            return
+        record = self.records[self.count]
+        record["time"] = timestamp
+        record["state"] = state
+        for i, frame in enumerate(frames):
+            record["frames"][i] = frame
+        self.count += 1
+        self._count[0] = self.count
+
+    def close(self):
+        """Flush, and trim the file to the frames recorded."""
+        if self.records is None:
+            return
+        self.records.flush()
+        self._count.flush()
+        size = HEADER_SIZE + self.count * self.records.dtype.itemsize
+        self.records = self._count = None
+        os.truncate(self.filename, size)
+
+
+class FrameReader(object):
+    """Read-only view of a recording. len() is the frame count; indexing
+       gives a record with "time", "state" and "frames" (eyes first);
+       'times' and column() give whole columns, 'run' the recorder's
+       run settings."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("%r is not an eye recording" % filename)
+        count, length = struct.unpack_from("<QI", header, len(MAGIC))
+        self.info = json.loads(header[20:20 + length].decode())
+        self.state_names = self.info["state"]
+        self.run = self.info.get("run", {})
+        dtype = _record_dtype(self.info)
+        # A file still being recorded (or cut short) holds fewer records
+        available = (os.path.getsize(filename) - HEADER_SIZE) // dtype.itemsize
+        count = min(count, available)
+        self.records = (np.memmap(filename, dtype, "r", HEADER_SIZE, (count,))
+                        if count else np.zeros(0, dtype))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def times(self):
+        return self.records["time"]
+
+    def column(self, name):
+        """One state value (e.g. "pupil", "x0") for every frame."""
+        return self.records["state"][:, self.state_names.index(name)]
+
+
+def rgb565_to_rgb(frame):
+    """(h,w) RGB565 image to (h,w,3) uint8 RGB, for viewing or saving."""
+    pixels = frame.astype(np.uint16)
+    rgb = np.empty(frame.shape + (3,), np.uint8)
+    rgb[..., 0] = (pixels >> 11) * 255 // 31
+    rgb[..., 1] = (pixels >> 5 & 0x3F) * 255 // 63
+    rgb[..., 2] = (pixels & 0x1F) * 255 // 31
+    return rgb
+
+
+def run_text(run):
+    """The run settings stored by FrameRecorder, as entry point options."""
+    return " ".join("--%s %s" % (name.replace("_", "-"), run[name])
+                    for name in sorted(run)
+                    if run[name] is not None) or "(none)"
+
+
+def timing_report(reader):
+    """Text summary of a recording's frame intervals."""
+    times = reader.times
+    if len(times) < 2:
+        return "%d frames" % len(times)
+    ms = np.diff(times) * 1000.0
+    elapsed = times[-1] - times[0]
+    return "\n".join((
+        "%d frames, %.3f s, %.1f fps" % (
+            len(times), elapsed, (len(times) - 1) / max(elapsed, 1e-9)),
+        "  interval ms  p50 %.2f  p95 %.2f  p99 %.2f  max %.2f  std %.2f" % (
+            np.percentile(ms, 50), np.percentile(ms, 95),
+            np.percentile(ms, 99), ms.max(), ms.std())))
+
+
+def compare_report(a, b):
+    """Text summary of per-frame differences between two recordings of
+       the same kind of frames, up to the shorter one's length."""
+    if (a.info["shape"] != b.info["shape"] or
+            a.info["dtype"] != b.info["dtype"]):
+        return "recordings have different frame formats"
+    lines = []
+    for run in (a.run, b.run):
+        if run.get("seed") is None or not run.get("fixed_fps"):
+            lines.append("not recorded with --seed and --fixed-fps; frames "
+                         "differ from run to run")
+            break
+    else:
+        if a.run != b.run:
+            lines.append("recorded with different settings: %s / %s" % (
+                run_text(a.run), run_text(b.run)))
+    count = min(len(a), len(b))
+    changed = np.empty(count)
+    for i in range(count): # Frame by frame, so only two are paged in
+        differs = a[i]["frames"] != b[i]["frames"]
+        if len(a.info["shape"]) == 3: # RGB: any channel
+            differs = differs.any(axis=-1)
+        changed[i] = np.count_nonzero(differs)
+    pixels = np.prod(a.info["shape"][:2]) * a.info["eyes"]
+    differing = np.flatnonzero(changed)
+    lines.append("%d frames compared, %d differ" % (count, len(differing)))
+    if len(differing):
+        lines.append("  first at frame %d; changed pixels mean %.2f%%, "
+                     "max %.2f%%" % (differing[0],
+                                     100.0 * changed.mean() / pixels,
+                                     100.0 * changed.max() / pixels))
+    return "\n".join(lines)
+
+
+def add_record_arguments(parser):
+    """Add the frame recording options to an entry point's
+       ArgumentParser."""
+    parser.add_argument("--record", default="",
+                        help="record eye frames to this file, see "
+                             "recorder.py")
+    parser.add_argument("--record-frames", type=int, default=3600,
+                        help="maximum frames to record")
+    parser.add_argument("--seed", type=int,
+                        help="seed the random eye motion, for repeatable "
+                             "runs")
+    parser.add_argument("--fixed-fps", type=float, default=0,
+                        help="headless: advance the animation clock by "
+                             "1/FPS each frame instead of by wall time")
+
+
+def recorder_from_args(args, state_names=()):
+    """FrameRecorder for the options added by add_record_arguments(), or
+       None if --record wasn't given."""
+    if not args.record:
+        return None
+    return FrameRecorder(args.record, args.record_frames, state_names,
+                         {"seed": args.seed,
+                          "fixed_fps": (args.fixed_fps or None)
+                          if args.headless else None})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eye recording summary")
+    parser.add_argument("recording")
+    parser.add_argument("other", nargs="?",
+                        help="second recording to compare frames with")
+    args = parser.parse_args()
+    reader = FrameReader(args.recording)
+    print("run: " + run_text(reader.run))
+    print(timing_report(reader))
+    if args.other:
+        print(compare_report(reader, FrameReader(args.other)))
@@ -0,0 +1,438 @@
+"""Eye screen output from Python, without fbx2. fbx2 snapshots the whole
+   HDMI framebuffer through dispmanx, reads it back, crops the two eye
+   squares and byte-swaps them pixel by pixel. EyeOutput reads back only
+   the two eye squares of each rendered frame (see eye_regions()), does
+   the 2x2 area downsample and big-endian RGB565 packing in NumPy, and
+   hands the two per-eye buffers to a pair of links, written in the
+   background (see transport.py): the screens themselves over spidev, a
+   pair of files or FIFOs, or memory (for tests). Works the same on a
+   headless display, so the whole path can be checked off the Pi.
+
+       python3 eyes.py --screens spi --screen-type ips --radius 240
+       python3 eyes.py --headless --frames 300 --screens memory
+
+   Geometry, screen types and init commands follow fbx2.c; don't run both
+   at once. Frames are in framebuffer order: left square first (the right
+   eye, on spidev0.0), then the right square (left eye, spidev1.2).
+"""
+
+import collections
+import fcntl
+import os
+import stat
+import struct
+import time
+import numpy as np
+from transport import ScreenTransport
+
+# Screen types as in fbx2.c: size, default SPI bitrate, init command list
+# (command, arg count | 0x80 if a delay follows, args, delay ms (255 =
+# 500), ..., 0 = end) and a function giving the commands that open a
+# pixel window (x0, y0, x1, y1 inclusive) for writing.
+Screen = collections.namedtuple("Screen", "width height bitrate init window")
+
+INIT_OLED = bytes((
+    0xFD, 1, 0x12,             # Command lock setting, unlock 1/2
+    0xFD, 1, 0xB1,             # Command lock setting, unlock 2/2
+    0xAE, 0,                   # Display off
+    0xB3, 1, 0xF0,             # Clock div (F1=typical, F0=faster refresh)
+    0xCA, 1, 0x7F,             # Duty cycle (128 lines)
+    0xA2, 1, 0x00,             # Display offset (0)
+    0xA1, 1, 0x00,             # Start line (0)
+    0xA0, 1, 0x74,             # Set remap, color depth (5/6/5)
+    0xB5, 1, 0x00,             # Set GPIO (disable)
+    0xAB, 1, 0x01,             # Function select (internal regulator)
+    0xB4, 3, 0xA0, 0xB5, 0x55, # Set VSL (external)
+    0xC1, 3, 0xFF, 0xA3, 0xFF, # Contrast A/B/C
+    0xC7, 1, 0x0F,             # Contrast master (reset)
+    0xB1, 1, 0x32,             # Set precharge & discharge
+    0xBB, 1, 0x07,             # Precharge voltage of color A/B/C
+    0xB2, 3, 0xA4, 0x00, 0x00, # Display enhancement
+    0xB6, 1, 0x01,             # Precharge period
+    0xBE, 1, 0x05,             # Set VcomH (0.82 x Vcc)
+    0xA6, 0,                   # Normal display
+    0xAF, 0,                   # Display on
+    0xB8, 64,                  # Gamma table, 64 values, no delay
+    0x00, 0x08, 0x0D, 0x12, 0x17, 0x1B, 0x1F, 0x22,
+    0x26, 0x2A, 0x2D, 0x30, 0x34, 0x37, 0x3A, 0x3D,
+    0x40, 0x43, 0x46, 0x49, 0x4C, 0x4F, 0x51, 0x54,
+    0x57, 0x59, 0x5C, 0x5F, 0x61, 0x64, 0x67, 0x69,
+    0x6C, 0x6E, 0x71, 0x73, 0x76, 0x78, 0x7B, 0x7D,
+    0x7F, 0x82, 0x84, 0x86, 0x89, 0x8B, 0x8D, 0x90,
+    0x92, 0x94, 0x97, 0x99, 0x9B, 0x9D, 0x9F, 0xA2,
+    0xA4, 0xA6, 0xA8, 0xAA, 0xAD, 0xAF, 0xB1, 0xB3,
+    0x00))
+
+INIT_TFT = bytes((
+    0x01, 0x80, 150,           # Software reset, 0 args, w/150ms delay
+    0x11, 0x80, 255,           # Out of sleep mode, 0 args, w/500ms delay
+    0xB1, 3, 0x01, 0x2C, 0x2D, # Frame rate ctrl - normal mode
+    0xB2, 3, 0x01, 0x2C, 0x2D, # Frame rate control - idle mode
+    0xB3, 6, 0x01, 0x2C, 0x2D, # Frame rate ctrl - partial mode, dot
+    0x01, 0x2C, 0x2D,          # and line inversion modes
+    0xB4, 1, 0x07,             # Display inversion ctrl: no inversion
+    0xC0, 3, 0xA2, 0x02, 0x84, # Power control 1: -4.6V, AUTO mode
+    0xC1, 1, 0xC5,             # Pwr ctrl 2: VGH25=2.4C VGSEL=-10 VGH=3*AVDD
+    0xC2, 2, 0x0A, 0x00,       # Pwr ctrl 3: opamp current small, boost freq
+    0xC3, 2, 0x8A, 0x2A,       # Pwr ctrl 4: BCLK/2, Opamp small & med low
+    0xC4, 2, 0x8A, 0xEE,       # Power control 5
+    0xC5, 1, 0x0E,             # Power control
+    0x20, 0,                   # Don't invert display
+    0x36, 1, 0xC8,             # MADCTL: row addr/col addr, bottom-to-top
+    0x3A, 1, 0x05,             # Color mode: 16-bit color
+    0x2A, 4, 0x00, 0x00, 0x00, 0x7F, # Column addr set, 0 to 127
+    0x2B, 4, 0x00, 0x00, 0x00, 0x7F, # Row addr set, 0 to 127
+    0xE0, 16,                  # Gamma (positive polarity)
+    0x02, 0x1c, 0x07, 0x12, 0x37, 0x32, 0x29, 0x2d,
+    0x29, 0x25, 0x2B, 0x39, 0x00, 0x01, 0x03, 0x10,
+    0xE1, 16,                  # Gamma (negative polarity)
+    0x03, 0x1d, 0x07, 0x06, 0x2E, 0x2C, 0x29, 0x2D,
+    0x2E, 0x2E, 0x37, 0x3F, 0x00, 0x00, 0x02, 0x10,
+    0x13, 0x80, 10,            # Normal display on, w/10ms delay
+    0x29, 0x80, 100,           # Main screen turn on, w/100ms delay
+    0x00))
+
+INIT_IPS = bytes((
+    0x01, 0x80, 150,           # Soft reset, no args, 150 ms delay
+    0x11, 0x80, 255,           # Out of sleep, no args, 500 ms delay
+    0x3A, 0x81, 0x55, 10,      # COLMOD, 1 arg, 10ms delay
+    0x36, 1, 0x00,             # MADCTL, 1 arg (RGB), no delay
+    0x26, 1, 0x02,             # GAMSET, 1 arg (curve 2 (G1.8)), no delay
+    0xBA, 1, 0x04,             # DGMEN, 1 arg (enable gamma), no delay
+    0x21, 0x80, 10,            # INVON, no args, 10 ms delay
+    0x13, 0x80, 10,            # NORON, no args, 10 ms delay
+    0x29, 0x80, 255,           # DISPON, no args, 500 ms delay
+    0x00))
+
+
+def _window_ssd1351(x0, y0, x1, y1):
+    return ((0x15, bytes((x0, x1))), (0x75, bytes((y0, y1))),
+            (0x5C, b""))
+
+
+def _window_st77xx(x_offset, y_offset):
+    def window(x0, y0, x1, y1):
+        return ((0x2A, struct.pack(">HH", x0 + x_offset, x1 + x_offset)),
+                (0x2B, struct.pack(">HH", y0 + y_offset, y1 + y_offset)),
+                (0x2C, b""))
+    return window
+
+
+SCREENS = {
+    "oled": Screen(128, 128, 10000000, INIT_OLED, _window_ssd1351),
+    "tft":  Screen(128, 128, 12000000, INIT_TFT, _window_st77xx(2, 3)),
+    "ips":  Screen(240, 240, 80000000, INIT_IPS, _window_st77xx(0, 0)),
+}
+
+DC_PIN = 5    # Data/command select, shared by both screens
+RESET_PIN = 6 # Reset, shared by both screens
+
+SPI_DEVICES = ("/dev/spidev0.0", "/dev/spidev1.2")
+SPI_IOC_WR_MODE = 0x40016b01         # _IOW('k', 1, __u8)
+SPI_IOC_WR_MAX_SPEED_HZ = 0x40046b04 # _IOW('k', 4, __u32)
+
+
+def command_list(data):
+    """Yield (command, args, delay_ms) from an init command list in
+       fbx2's format (see SCREENS)."""
+    i = 0
+    while data[i]:
+        command, count = data[i], data[i + 1]
+        i += 2
+        n = count & 0x7F
+        args = data[i:i + n]
+        i += n
+        delay = 0
+        if count & 0x80:
+            delay = 500 if data[i] == 255 else data[i]
+            i += 1
+        yield command, args, delay
+
+
+def eye_regions(width, height, size):
+    """(x, y, w, h) of the two eye squares in a width x height frame, from
+       top left, as fbx2 crops them: 2*size pixels square (downsampled to
+       size for the screens), centred in each half of the frame."""
+    half = width // 2
+    side = 2 * size
+    x = (half - side) // 2 & ~1
+    y = (height - side) // 2 & ~1
+    return (x, y, side, side), (half + x, y, side, side)
+
+
+def read_region(display, x, y, w, h):
+    """RGB pixels, (h,w,3) uint8 with the top row first, of a region of
+       the frame just drawn (x, y from top left). Call after drawing and
+       before the next loop_running(), which swaps the frame out. A
+       headless display is read from its rasterizer, a pi3d one with
+       glReadPixels of just that region."""
+    if hasattr(display, "rasterizer"):
+        return display.rasterizer.color[y:y + h, x:x + w]
+    from pi3d.util.Screenshot import masked_screenshot
+    return masked_screenshot(x, display.height - y - h, w, h)
+
+
+def rgb565(rgb, downsample=False):
+    """Pack an (h,w,3) uint8 RGB image as big-endian RGB565 (the screens'
+       byte order), (h,w) '>u2'. With downsample, each output pixel is
+       the average of a 2x2 block of the (even-sized) input, as fbx2's
+       half-size snapshot."""
+    if downsample:
+        # Strided adds of the four corners of each block (several times
+        # quicker than reshaping and summing). The sum is 0-1020, so
+        # shifting it 2 bits further than the plain packing below
+        # averages and truncates in one step.
+        total = rgb[0::2, 0::2].astype(np.uint16)
+        total += rgb[1::2, 0::2]
+        total += rgb[0::2, 1::2]
+        total += rgb[1::2, 1::2]
+        r, g, b = total[..., 0], total[..., 1], total[..., 2]
+        shift = 2
+    else:
+        rgb = rgb.astype(np.uint16)
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+        shift = 0
+    packed = np.empty(r.shape, ">u2")
+    packed[...] = ((r >> (3 + shift) << 11) | (g >> (2 + shift) << 5) |
+                   (b >> (3 + shift)))
+    return packed
+
+
+def changed_window(previous, frames):
+    """Smallest (x0, y0, x1, y1) window, inclusive, covering every pixel
+       that differs between the frames in 'previous' and those in
+       'frames' (equal-sized arrays, one per screen), or None if nothing
+       changed. One window covers all the screens, since they get the
+       same window commands."""
+    changed = previous[0] != frames[0]
+    for old, new in zip(previous[1:], frames[1:]):
+        changed |= old != new
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(changed.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+
+
+def spidev_bufsiz(default=4096):
+    """Largest single spidev transfer, from the driver's bufsiz option."""
+    try:
+        with open("/sys/module/spidev/parameters/bufsiz") as f:
+            return int(f.read())
+    except (IOError, ValueError):
+        return default
+
+
+class DeviceLink(object):
+    """Byte stream to one screen: a /dev/spidev node (SPI mode 0 at
+       bitrate, written in transfers of at most the spidev buffer size,
+       as fbx2 does), or a plain file or FIFO, which gets each frame's
+       pixel data back to back."""
+
+    def __init__(self, path, bitrate=0, chunk=0):
+        self.path = path
+        flags = os.O_WRONLY
+        if not os.path.exists(path):
+            flags |= os.O_CREAT
+        elif stat.S_ISREG(os.stat(path).st_mode):
+            flags |= os.O_TRUNC
+        self.fd = os.open(path, flags, 0o644)
+        self.spi = stat.S_ISCHR(os.fstat(self.fd).st_mode)
+        if self.spi:
+            fcntl.ioctl(self.fd, SPI_IOC_WR_MODE, struct.pack("B", 0))
+            if bitrate:
+                fcntl.ioctl(self.fd, SPI_IOC_WR_MAX_SPEED_HZ,
+                            struct.pack("I", bitrate))
+            chunk = chunk or spidev_bufsiz()
+        self.chunk = chunk
+        self.bytes = 0 # Total written
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        step = self.chunk or len(view)
+        for start in range(0, len(view), step):
+            block = view[start:start + step]
+            while len(block):
+                block = block[os.write(self.fd, block):]
+        self.bytes += len(view)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MemoryLink(object):
+    """In-memory stand-in for a screen: keeps the last frame written,
+       for tests."""
+
+    spi = False
+
+    def __init__(self):
+        self.last = None
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.last = bytes(data)
+        self.writes += 1
+        self.bytes += len(self.last)
+
+    def close(self):
+        pass
+
+
+class ScreenPair(object):
+    """Sink for the two eye buffers: writes each to its link. If a screen
+       type and GPIO module (RPi.GPIO) are given, the screens are reset
+       and initialized first, and each frame is preceded by the commands
+       that open a pixel window. Commands go to both screens at once,
+       since they share the D/C and reset pins.
+
+       SPI bandwidth caps the frame rate, yet between saccades the eyes
+       hold still for up to a second and only the lids or pupil change,
+       if anything. So with screen commands, each frame is compared with
+       the last one sent and only the window around the changed pixels
+       is written (see changed_window()); nothing at all if none did.
+       When the window would be more than full_fraction of the screen the
+       whole frame goes instead, and also every full_interval frames, so
+       pixels garbled by an SPI glitch don't stay that way while the eyes
+       hold still. Plain file and memory links always get whole frames."""
+
+    def __init__(self, links, screen=None, gpio=None, dc_pin=DC_PIN,
+                 reset_pin=RESET_PIN, full_fraction=0.75, full_interval=60):
+        self.links = links
+        self.screen = screen
+        self.gpio = gpio
+        self.dc_pin = dc_pin
+        self.full_fraction = full_fraction
+        self.full_interval = full_interval
+        self.shown = None  # Frames last written, for dirty windows
+        self.frames = 0    # Frames sent
+        self.partial = 0   # ...of which as a changed window only
+        self.unchanged = 0 # ...of which skipped, nothing changed
+        if gpio is not None:
+            gpio.setmode(gpio.BCM)
+            gpio.setup(dc_pin, gpio.OUT)
+            gpio.setup(reset_pin, gpio.OUT)
+            for level in (gpio.HIGH, gpio.LOW, gpio.HIGH):
+                gpio.output(reset_pin, level)
+                time.sleep(0.000005)
+            for command, args, delay in command_list(screen.init):
+                self.command(command, args)
+                if delay:
+                    time.sleep(delay * 0.001)
+
+    def command(self, command, args=b""):
+        """Send a command and its args to both screens."""
+        self.gpio.output(self.dc_pin, self.gpio.LOW)
+        for link in self.links:
+            link.write(bytes((command,)))
+        self.gpio.output(self.dc_pin, self.gpio.HIGH)
+        if len(args):
+            for link in self.links:
+                link.write(args)
+
+    def send(self, left, right):
+        """Write one frame to each screen (RGB565 arrays, see rgb565())."""
+        frames = self.start_frame(left, right)
+        if frames is not None:
+            for link, frame in zip(self.links, frames):
+                link.write(frame)
+
+    def start_frame(self, left, right):
+        """First half of send(): issue the window commands for a frame and
+           return the data to write to each link after them, or None if
+           there's nothing to write. Lets a transport write both screens
+           at once (see transport.py)."""
+        frames = (left, right)
+        self.frames += 1
+        if self.gpio is None:
+            return frames
+        h, w = left.shape
+        window = (0, 0, w - 1, h - 1)
+        if (self.shown is not None and
+                not (self.full_interval and
+                     self.frames % self.full_interval == 0)):
+            window = changed_window(self.shown, frames)
+            if window is None:
+                self.unchanged += 1
+                return None
+            x0, y0, x1, y1 = window
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > self.full_fraction * w * h:
+                window = (0, 0, w - 1, h - 1)
+            else:
+                frames = [np.ascontiguousarray(frame[y0:y1 + 1, x0:x1 + 1])
+                          for frame in frames]
+                self.partial += 1
+        for command, args in self.screen.window(*window):
+            self.command(command, args)
+        self.shown = (left.copy(), right.copy())
+        return frames
+
+    def close(self):
+        for link in self.links:
+            link.close()
+
+
+class EyeOutput(object):
+    """Per-frame eye readback for a display whose eyes are laid out as for
+       fbx2 (see eye_regions()); send() after drawing each frame passes
+       the two downsampled RGB565 buffers to sink.submit(), which mustn't
+       hold up rendering (a transport.ScreenTransport), and returns them.
+       With no sink, frames are only read (e.g. to record them, see
+       recorder.py)."""
+
+    def __init__(self, display, screen, sink):
+        self.display = display
+        self.screen = screen
+        self.sink = sink
+        self.regions = eye_regions(display.width, display.height,
+                                   screen.width)
+        # A headless display only rasterizes when something reads frames
+        if hasattr(display, "rasterize"):
+            display.rasterize = True
+
+    def send(self):
+        left, right = (rgb565(read_region(self.display, *region), True)
+                       for region in self.regions)
+        if self.sink is not None:
+            self.sink.submit(left, right)
+        return left, right
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+
+def add_screen_arguments(parser):
+    """Add the eye screen output options to an entry point's
+       ArgumentParser."""
+    parser.add_argument("--screens", default="",
+                        help="send eyes to 'spi' screens (instead of "
+                             "fbx2), 'memory', or files/FIFOs LEFT,RIGHT")
+    parser.add_argument("--screen-type", choices=sorted(SCREENS),
+                        default="oled")
+    parser.add_argument("--bitrate", type=int, default=0,
+                        help="SPI bitrate (default depends on screen type)")
+
+
+def output_from_args(args, display, readback=False):
+    """EyeOutput for the options added by add_screen_arguments(). Without
+       --screens, None, or if readback is set an EyeOutput that just reads
+       frames."""
+    screen = SCREENS[args.screen_type]
+    if not args.screens:
+        return EyeOutput(display, screen, None) if readback else None
+    gpio = None
+    if args.screens == "spi":
+        import RPi.GPIO as gpio
+        bitrate = args.bitrate or screen.bitrate
+        links = [DeviceLink(path, bitrate) for path in SPI_DEVICES]
+    elif args.screens == "memory":
+        links = [MemoryLink(), MemoryLink()]
+    else:
+        paths = args.screens.split(",")
+        if len(paths) != 2:
+            raise ValueError("--screens: need 'spi', 'memory' or LEFT,RIGHT")
+        links = [DeviceLink(path) for path in paths]
+    pair = ScreenPair(links, screen if gpio else None, gpio)
+    return EyeOutput(display, screen, ScreenTransport(pair))
@@ -0,0 +1,199 @@
+"""Compiled geometry cache for the eye SVGs. Parsing an SVG and sampling
+   its paths is a noticeable slice of boot time on a Pi Zero, and the
+   result only depends on the SVG contents, the point counts requested
+   and eyeRadius. load_eye_points() stores the scaled point arrays in a
+   small .npz file keyed on all three and loads that directly on later
+   boots, falling back to parsing the SVG if the cache is missing or
+   stale. load_sclera() does likewise for the lathed sclera buffers.
+   Can also be run as a build step to precompile the SVG cache:
+
+       python3 svgcache.py graphics/eye.svg --radius 128 240
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import numpy as np
+import pi3d
+from gfxutil import SvgEyeDocument, re_axis, scale_points_array
+from meshdetail import PRESETS, choose_detail
+
+
+def eye_paths(iris_points=32, lid_points=33):
+    """Path name, number of points, closed, reverse; as used by all the
+       eye renderers (see get_points()), with the given point counts (see
+       meshdetail.py)."""
+    return (
+        ("pupilMin"      , iris_points, True , True ),
+        ("pupilMax"      , iris_points, True , True ),
+        ("iris"          , iris_points, True , True ),
+        ("scleraFront"   ,           0, False, False),
+        ("scleraBack"    ,           0, False, False),
+        ("upperLidClosed",  lid_points, False, True ),
+        ("upperLidOpen"  ,  lid_points, False, True ),
+        ("upperLidEdge"  ,  lid_points, False, False),
+        ("lowerLidClosed",  lid_points, False, False),
+        ("lowerLidOpen"  ,  lid_points, False, False),
+        ("lowerLidEdge"  ,  lid_points, False, False))
+
+
+EYE_PATHS = eye_paths()
+
+CACHE_VERSION = 1 # Bump if the sampling or file layout changes
+
+
+def cache_key(svg_data, paths, radius):
+    """Hex digest identifying one compiled result: SVG file contents,
+       path list (names, point counts, flags) and eye radius."""
+    digest = hashlib.sha1(svg_data)
+    digest.update(repr((CACHE_VERSION, tuple(paths),
+                        float(radius))).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def compile_eye(svg_data, radius, paths=EYE_PATHS):
+    """Parse SVG data (bytes), extract the given paths and scale them to
+       eye dimensions. Returns dict of path name to (N,2) float32 array."""
+    doc = SvgEyeDocument(svg_data)
+    points = {}
+    for name, num_points, closed, reverse in paths:
+        points[name] = doc.get_points_array(name, num_points, closed, reverse)
+        scale_points_array(points[name], doc.view_box, radius)
+    return points
+
+
+def save_npz(filename, **arrays):
+    """np.savez() to filename (creating its directory if needed), writing
+       under a temporary name and moving into place so a power cut
+       mid-write never leaves a truncated cache file behind. Raises
+       OSError if the filesystem isn't writable."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temp_file = filename + ".tmp"
+    with open(temp_file, "wb") as out:
+        np.savez(out, **arrays)
+    os.replace(temp_file, filename)
+
+
+def default_cache_dir(filename):
+    """Cache lives alongside the SVG, in a .cache subdirectory."""
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), ".cache")
+
+
+def load_eye_points(filename, radius, paths=EYE_PATHS, cache_dir=""):
+    """Return dict of path name to scaled (N,2) float32 point array for
+       an eye SVG, same as get_points_array() + scale_points_array() on
+       each path, using the compiled cache when it's current. cache_dir
+       defaults to default_cache_dir(filename); pass None to bypass the
+       cache completely."""
+    with open(filename, "rb") as svg_file:
+        svg_data = svg_file.read()
+    if cache_dir is None:
+        return compile_eye(svg_data, radius, paths)
+    if not cache_dir:
+        cache_dir = default_cache_dir(filename)
+
+    key = cache_key(svg_data, paths, radius)
+    base = os.path.splitext(os.path.basename(filename))[0]
+    cache_file = os.path.join(cache_dir, "%s-%s.npz" % (base, key[:16]))
+    try:
+        with np.load(cache_file) as npz:
+            if str(npz["key"]) == key:
+                return {path[0]: npz[path[0]] for path in paths}
+    except (OSError, KeyError, ValueError):
+        pass # Missing, stale or damaged; recompile below
+
+    points = compile_eye(svg_data, radius, paths)
+    try:
+        counts = np.array([path[1] for path in paths])
+        save_npz(cache_file, key=np.array(key),
+                 radius=np.array(float(radius)), counts=counts, **points)
+        # Remove files compiled at this same radius and point counts from
+        # an older version of the SVG, else they'd pile up with every
+        # artwork edit. Other radii and mesh details are left alone, they
+        # may still be in use.
+        default_counts = [path[1] for path in EYE_PATHS]
+        for old_file in glob.glob(os.path.join(cache_dir, base + "-*.npz")):
+            if old_file != cache_file:
+                try:
+                    with np.load(old_file) as npz:
+                        old_counts = (npz["counts"] if "counts" in npz
+                                      else default_counts)
+                        stale = (float(npz["radius"]) == float(radius) and
+                                 np.array_equal(old_counts, counts))
+                except (OSError, KeyError, ValueError):
+                    stale = True
+                if stale:
+                    os.remove(old_file)
+    except OSError:
+        pass # Read-only filesystem or similar; just go without a cache
+    return points
+
+
+_sclera_buffers = {} # In-memory copies, keyed same as the .npz files
+
+
+def load_sclera(path, sides, texture_offset, cache_dir=None):
+    """Return a sclera shape: a pi3d.Lathe of path with given number of
+       sides, passed through re_axis() with texture_offset. The
+       transformed vertex buffer and indices (at texture offset 0) are
+       kept in memory and, if cache_dir is given, in a .npz file there.
+       Later calls for the same path and sides (the other eye, a style
+       swap, the next boot) build a plain pi3d.Shape from those arrays
+       rather than lathing and re-axising again."""
+    path = np.asarray(path, dtype=np.float64)
+    digest = hashlib.sha1(path.tobytes())
+    digest.update(repr((CACHE_VERSION, int(sides))).encode("utf-8"))
+    key = digest.hexdigest()[:16]
+
+    arrays = _sclera_buffers.get(key)
+    cache_file = None
+    if arrays is None and cache_dir:
+        cache_file = os.path.join(cache_dir, "sclera-%s.npz" % key)
+        try:
+            with np.load(cache_file) as npz:
+                arrays = (npz["array_buffer"], npz["indices"])
+        except (OSError, KeyError, ValueError):
+            pass
+    if arrays is None:
+        shape = pi3d.Lathe(path=[tuple(p) for p in path.tolist()],
+                           sides=sides)
+        re_axis(shape, 0.0)
+        arrays = (shape.buf[0].array_buffer.copy(),
+                  shape.buf[0].element_array_buffer.copy())
+        if cache_file:
+            try:
+                save_npz(cache_file, array_buffer=arrays[0],
+                         indices=arrays[1])
+            except OSError:
+                pass
+    _sclera_buffers[key] = arrays
+
+    abuf, indices = arrays
+    shape = pi3d.Shape(None, None, "sclera", 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                       1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+    shape.buf = [pi3d.Buffer(shape, abuf[:, 0:3], abuf[:, 6:8], indices,
+                             abuf[:, 3:6], False)]
+    shape.buf[0].array_buffer[:, 6] += texture_offset
+    return shape
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompile eye SVG geometry cache")
+    parser.add_argument("svg", nargs="+")
+    parser.add_argument("--radius", type=float, nargs="+", default=[128])
+    parser.add_argument("--detail", choices=["auto"] + list(PRESETS),
+                        default="auto",
+                        help="mesh detail, see meshdetail.py (auto: as "
+                             "chosen for each radius, with no time budget)")
+    parser.add_argument("--cache-dir", default="")
+    args = parser.parse_args()
+    for svg in args.svg:
+        for radius in args.radius:
+            detail = (choose_detail(radius) if args.detail == "auto"
+                      else PRESETS[args.detail])
+            load_eye_points(svg, radius,
+                            eye_paths(detail.iris_points, detail.lid_points),
+                            cache_dir=args.cache_dir)
+            print("%s @ radius %g" % (svg, radius))
@@ -0,0 +1,100 @@
+"""Threaded transport to a pair of screens, as fbx2's SPI threads do it
+   but usable from Python: renderers hand each frame to submit() and go
+   on drawing the next while it's written. Each screen has its own
+   writer thread, so both are written at once; a dispatcher thread picks
+   up the newest submitted frame, waits at a barrier for both writers to
+   finish the last one, issues the screen commands (the screens share a
+   D/C pin, so no pixel data may be in flight) and releases the writers
+   through a second barrier. Two frame slots (double buffering): the one
+   being written, and the newest submitted, which a later submit()
+   replaces if the screens haven't caught up ('dropped').
+
+       pair = screens.ScreenPair(links, screen, gpio)
+       transport = ScreenTransport(pair)
+       ...
+       transport.submit(left, right) # Never blocks
+
+   'pair' is a screens.ScreenPair, or anything with 'links' (objects with
+   write(data)) and start_frame(left, right) returning the data for each
+   link or None. Links split writes to the spidev buffer size; a FIFO
+   link simply blocks its writer thread until the reader catches up.
+"""
+
+import atexit
+import threading
+
+
+class ScreenTransport(object):
+    """Writes frames given to submit() to pair's links in background
+       threads (see module notes)."""
+
+    def __init__(self, pair):
+        self.pair = pair
+        self.submitted = 0 # Frames passed to submit()
+        self.dropped = 0   # ...replaced by a newer one before being sent
+        self.written = 0   # ...handed to the writers
+        self._pending = None
+        self._writing = None
+        self._running = True
+        self._lock = threading.Condition()
+        self._barrier = threading.Barrier(len(pair.links) + 1)
+        self._writers = [threading.Thread(target=self._write,
+                                          args=(index, link), daemon=True)
+                         for index, link in enumerate(pair.links)]
+        self._dispatcher = threading.Thread(target=self._dispatch,
+                                            daemon=True)
+        for thread in self._writers + [self._dispatcher]:
+            thread.start()
+        atexit.register(self.close)
+
+    def submit(self, left, right):
+        """Queue a frame for the screens, replacing any frame not yet
+           started. The arrays are handed over, not copied; don't
+           modify them afterwards."""
+        with self._lock:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (left, right)
+            self.submitted += 1
+            self._lock.notify()
+
+    def _dispatch(self):
+        try:
+            while True:
+                with self._lock:
+                    while self._running and self._pending is None:
+                        self._lock.wait()
+                    frame, self._pending = self._pending, None
+                self._barrier.wait() # Writers done with the last frame
+                if frame is None: # Closed, and everything's written
+                    break
+                self._writing = self.pair.start_frame(*frame)
+                self.written += 1
+                self._barrier.wait() # Writers start on this one
+        except threading.BrokenBarrierError:
+            pass
+        self._barrier.abort() # Stops the writers
+
+    def _write(self, index, link):
+        try:
+            while True:
+                self._barrier.wait()
+                self._barrier.wait()
+                if self._writing is not None:
+                    link.write(self._writing[index])
+        except threading.BrokenBarrierError:
+            pass
+
+    def close(self, timeout=2.0):
+        """Send any frame still pending, stop the threads and close the
+           links."""
+        if not self._running:
+            return
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        self._dispatcher.join(timeout)
+        self._barrier.abort()
+        for thread in self._writers:
+            thread.join(timeout)
+        self.pair.close()